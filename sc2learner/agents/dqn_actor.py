@@ -0,0 +1,158 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import io
+import zmq
+
+import numpy as np
+from gym import spaces
+
+from sc2learner.agents.replay_memory import RemoteReplayMemory
+from sc2learner.agents.dqn_numpy_networks import NumpyDQNAgent
+from sc2learner.agents.dqn_numpy_networks import numpy_network_of
+from sc2learner.utils.utils import tprint
+
+
+class DQNActor(object):
+
+  def __init__(self,
+               memory_size,
+               memory_warmup_size,
+               env,
+               network,
+               discount,
+               send_freq=4.0,
+               ports=("5700", "5701", "5702"),
+               learner_ip="localhost",
+               use_numpy_inference=False):
+    assert type(env.action_space) == spaces.Discrete
+    assert len(ports) == 3
+    self._env = env
+    self._discount = discount
+    self._epsilon = 1.0
+    self._use_numpy_inference = use_numpy_inference
+
+    if use_numpy_inference:
+      self._agent = NumpyDQNAgent(numpy_network_of(network), env.action_space)
+    else:
+      from sc2learner.agents.dqn_agent import DQNAgent
+      self._agent = DQNAgent(network, env.action_space)
+    self._replay_memory = RemoteReplayMemory(
+        is_server=False,
+        memory_size=memory_size,
+        memory_warmup_size=memory_warmup_size,
+        send_freq=send_freq,
+        ports=ports[:2],
+        server_ip=learner_ip)
+
+    self._zmq_context = zmq.Context()
+    self._model_requestor = self._zmq_context.socket(zmq.REQ)
+    self._model_requestor.connect("tcp://%s:%s" % (learner_ip, ports[2]))
+
+  def run(self):
+    while True:
+      # fetch model
+      t = time.time()
+      self._update_model()
+      tprint("Update model time: %f eps: %f" % (time.time() - t, self._epsilon))
+      # rollout
+      t = time.time()
+      self._rollout()
+      tprint("Rollout time: %f" % (time.time() - t))
+
+  def _rollout(self):
+    rollout, done = [], False
+    observation = self._env.reset()
+    while not done:
+      action = self._agent.act(observation, eps=self._epsilon)
+      next_observation, reward, done, info = self._env.step(action)
+      rollout.append(
+          (observation, action, reward, next_observation, done))
+      observation = next_observation
+    self._push_rollout(rollout)
+
+  def _push_rollout(self, rollout):
+    discounted_return = 0
+    for transition in reversed(rollout):
+      reward = transition[2]
+      discounted_return = discounted_return * self._discount + reward
+      self._replay_memory.push(*transition, discounted_return)
+
+  def _update_model(self):
+      if self._use_numpy_inference:
+        self._model_requestor.send_string("request numpy model")
+        self._agent.load_params(self._model_requestor.recv_pyobj())
+      else:
+        import torch
+        self._model_requestor.send_string("request model")
+        file_object = io.BytesIO(self._model_requestor.recv_pyobj())
+        self._agent.load_params(
+            torch.load(file_object, map_location=lambda storage, loc: storage))
+      self._epsilon = self._model_requestor.recv_pyobj()
+
+
+class VecDQNActor(DQNActor):
+
+  def __init__(self,
+               memory_size,
+               memory_warmup_size,
+               envs,
+               network,
+               discount,
+               send_freq=4.0,
+               eps_alpha=0.0,
+               num_threads=1,
+               ports=("5700", "5701", "5702"),
+               learner_ip="localhost",
+               use_numpy_inference=False):
+    assert len(envs) > 0
+    for env in envs:
+      assert type(env.action_space) == spaces.Discrete
+      assert env.action_space.n == envs[0].action_space.n
+    if num_threads is not None and not use_numpy_inference:
+      import torch
+      torch.set_num_threads(num_threads)
+    super(VecDQNActor, self).__init__(memory_size=memory_size,
+                                      memory_warmup_size=memory_warmup_size,
+                                      env=envs[0],
+                                      network=network,
+                                      discount=discount,
+                                      send_freq=send_freq,
+                                      ports=ports,
+                                      learner_ip=learner_ip,
+                                      use_numpy_inference=use_numpy_inference)
+    self._envs = envs
+    self._eps_exponents = 1.0 + eps_alpha * np.arange(len(envs)) / \
+        max(len(envs) - 1, 1)
+
+  def run(self):
+    self._update_model()
+    observations = [env.reset() for env in self._envs]
+    rollouts = [[] for _ in self._envs]
+    num_frames, time_start = 0, time.time()
+    num_episodes_since_update = 0
+    while True:
+      eps = self._epsilon ** self._eps_exponents
+      actions = self._agent.act_batch(observations, eps)
+      for i, env in enumerate(self._envs):
+        next_observation, reward, done, info = env.step(actions[i])
+        rollouts[i].append(
+            (observations[i], actions[i], reward, next_observation, done))
+        if done:
+          self._push_rollout(rollouts[i])
+          num_frames += len(rollouts[i])
+          num_episodes_since_update += 1
+          rollouts[i] = []
+          tprint("Env %d episode done. Rollout-fps: %.1f eps: %f" %
+                 (i, num_frames / (time.time() - time_start), eps[i]))
+          next_observation = env.reset()
+        observations[i] = next_observation
+      # one model request per round of episodes, as a single-env actor makes
+      if num_episodes_since_update >= len(self._envs):
+        num_episodes_since_update = 0
+        t = time.time()
+        self._update_model()
+        tprint("Update model time: %f eps: %f" %
+               (time.time() - t, self._epsilon))
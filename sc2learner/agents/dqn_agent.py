@@ -27,6 +27,7 @@ from gym import spaces
 
 from sc2learner.agents.replay_memory import Transition
 from sc2learner.agents.replay_memory import RemoteReplayMemory
+from sc2learner.agents.dqn_numpy_networks import to_numpy_params
 from sc2learner.utils.utils import tprint
 
 
@@ -59,6 +60,22 @@ class DQNAgent(object):
     else:
       return self._action_space.sample()
 
+  def act_batch(self, observations, eps):
+    self._network.eval()
+    num = len(observations)
+    explore = np.random.uniform(size=num) < np.asarray(eps)
+    actions = np.random.randint(self._action_space.n, size=num)
+    if not explore.all():
+      greedy_ids = np.nonzero(~explore)[0]
+      observations = torch.from_numpy(
+          np.stack([observations[i] for i in greedy_ids]))
+      if torch.cuda.is_available():
+        observations = observations.pin_memory().cuda(non_blocking=True)
+      with torch.no_grad():
+        q = self._network(observations)
+        actions[greedy_ids] = q.data.max(1)[1].cpu().numpy()
+    return actions.tolist()
+
   def optimize_step(self,
                     obs_batch,
                     next_obs_batch,
@@ -134,71 +151,6 @@ class DQNAgent(object):
       return self._network.state_dict()
 
 
-class DQNActor(object):
-
-  def __init__(self,
-               memory_size,
-               memory_warmup_size,
-               env,
-               network,
-               discount,
-               send_freq=4.0,
-               ports=("5700", "5701", "5702"),
-               learner_ip="localhost"):
-    assert type(env.action_space) == spaces.Discrete
-    assert len(ports) == 3
-    self._env = env
-    self._discount = discount
-    self._epsilon = 1.0
-
-    self._agent = DQNAgent(network, env.action_space)
-    self._replay_memory = RemoteReplayMemory(
-        is_server=False,
-        memory_size=memory_size,
-        memory_warmup_size=memory_warmup_size,
-        send_freq=send_freq,
-        ports=ports[:2],
-        server_ip=learner_ip)
-
-    self._zmq_context = zmq.Context()
-    self._model_requestor = self._zmq_context.socket(zmq.REQ)
-    self._model_requestor.connect("tcp://%s:%s" % (learner_ip, ports[2]))
-
-  def run(self):
-    while True:
-      # fetch model
-      t = time.time()
-      self._update_model()
-      tprint("Update model time: %f eps: %f" % (time.time() - t, self._epsilon))
-      # rollout
-      t = time.time()
-      self._rollout()
-      tprint("Rollout time: %f" % (time.time() - t))
-
-  def _rollout(self):
-    rollout, done = [], False
-    observation = self._env.reset()
-    while not done:
-      action = self._agent.act(observation, eps=self._epsilon)
-      next_observation, reward, done, info = self._env.step(action)
-      rollout.append(
-          (observation, action, reward, next_observation, done))
-      observation = next_observation
-
-    discounted_return = 0
-    for transition in reversed(rollout):
-      reward = transition[2]
-      discounted_return = discounted_return * self._discount + reward
-      self._replay_memory.push(*transition, discounted_return)
-
-  def _update_model(self):
-      self._model_requestor.send_string("request model")
-      file_object = io.BytesIO(self._model_requestor.recv_pyobj())
-      self._agent.load_params(
-          torch.load(file_object, map_location=lambda storage, loc: storage))
-      self._epsilon = self._model_requestor.recv_pyobj()
-
-
 class DQNLearner(object):
 
   def __init__(self,
@@ -221,7 +173,11 @@ class DQNLearner(object):
                checkpoint_interval,
                print_interval,
                ports=("5700", "5701", "5702"),
-               init_model_path=None):
+               init_model_path=None,
+               init_replay_path=None,
+               save_replay_memory=False,
+               num_batch_threads=1,
+               num_batch_buffers=8):
     assert type(action_space) == spaces.Discrete
     self._agent = DQNAgent(network, action_space)
     self._replay_memory = RemoteReplayMemory(
@@ -229,6 +185,11 @@ class DQNLearner(object):
         memory_size=memory_size,
         memory_warmup_size=memory_warmup_size,
         ports=ports[:2])
+    if init_replay_path is not None:
+      t = time.time()
+      num_loaded = self._replay_memory.load(init_replay_path)
+      tprint("Restored %d transitions from %s in %.1f seconds." %
+             (num_loaded, init_replay_path, time.time() - t))
     if init_model_path is not None:
       self._agent.load_params(
           torch.load(init_model_path,
@@ -244,6 +205,10 @@ class DQNLearner(object):
     self._checkpoint_dir = checkpoint_dir
     self._checkpoint_interval = checkpoint_interval
     self._print_interval = print_interval
+    self._save_replay_memory = save_replay_memory
+    self._save_replay_thread = None
+    self._num_batch_threads = num_batch_threads
+    self._num_batch_buffers = num_batch_buffers
     self._discount = discount
     self._eps_start = eps_start
     self._eps_end = eps_end
@@ -257,17 +222,22 @@ class DQNLearner(object):
     self._reply_model_thread.start()
 
   def run(self):
-    batch_queue = queue.Queue(8)
-    batch_thread = Thread(target=self._prepare_batch,
-                          args=(batch_queue, self._batch_size,))
-    batch_thread.start()
+    prefetcher = BatchPrefetcher(replay_memory=self._replay_memory,
+                                 batch_size=self._batch_size,
+                                 num_threads=self._num_batch_threads,
+                                 num_buffers=self._num_batch_buffers)
+    prefetcher.start()
 
     updates, loss, total_rollout_frames = 0, [], 0
+    wait_time, compute_time = 0.0, 0.0
     time_start = time.time()
     while True:
       updates += 1
-      observation, next_observation, action, reward, done, mc_return = \
-          batch_queue.get()
+      t = time.time()
+      buffer_id, (observation, next_observation, action, reward, done,
+                  mc_return) = prefetcher.get()
+      wait_time += time.time() - t
+      t = time.time()
       self._epsilon = self._schedule_epsilon(updates)
       loss.append(self._agent.optimize_step(
           obs_batch=observation,
@@ -282,6 +252,8 @@ class DQNLearner(object):
           adam_eps=self._adam_eps,
           learning_rate=self._learning_rate,
           target_update_interval=self._target_update_interval))
+      prefetcher.release(buffer_id)
+      compute_time += time.time() - t
       self._model_params = self._agent.read_params()
       if updates % self._checkpoint_interval == 0:
         ckpt_path = os.path.join(self._checkpoint_dir,
@@ -294,38 +266,29 @@ class DQNLearner(object):
             / time_elapsed
         loss_mean = np.mean(loss)
         tprint("Update: %d	Train-fps: %.1f	Rollout-fps: %.1f	"
-               "Loss: %.5f	Epsilon: %.5f	Time: %.1f" % (updates, train_fps,
-               rollout_fps, loss_mean, self._epsilon, time_elapsed))
+               "Loss: %.5f	Epsilon: %.5f	Time: %.1f	Batch-wait: %.1f	"
+               "Compute: %.1f" % (updates, train_fps, rollout_fps, loss_mean,
+               self._epsilon, time_elapsed, wait_time, compute_time))
         time_start, loss = time.time(), []
+        wait_time, compute_time = 0.0, 0.0
         total_rollout_frames = self._replay_memory.total
 
-  def _prepare_batch(self, batch_queue, batch_size):
-    while True:
-      transitions = self._replay_memory.sample(batch_size)
-      batch = self._transitions_to_batch(transitions)
-      batch_queue.put(batch)
-
-  def _transitions_to_batch(self, transitions):
-    batch = Transition(*zip(*transitions))
-    observation = torch.from_numpy(np.stack(batch.observation))
-    next_observation = torch.from_numpy(np.stack(batch.next_observation))
-    reward = torch.FloatTensor(batch.reward)
-    action = torch.LongTensor(batch.action)
-    done = torch.Tensor(batch.done)
-    mc_return = torch.FloatTensor(batch.mc_return)
-
-    if torch.cuda.is_available():
-      observation = observation.pin_memory()
-      next_observation = next_observation.pin_memory()
-      action = action.pin_memory()
-      reward = reward.pin_memory()
-      mc_return = mc_return.pin_memory()
-      done = done.pin_memory()
-
-    return observation, next_observation, action, reward, done, mc_return
-
   def _save_checkpoint(self, checkpoint_path):
     torch.save(self._model_params, checkpoint_path)
+    if self._save_replay_memory:
+      if (self._save_replay_thread is not None and
+          self._save_replay_thread.is_alive()):
+        tprint("Skipped saving replay memory: previous save still running.")
+        return
+      self._save_replay_thread = Thread(target=self._save_replay)
+      self._save_replay_thread.start()
+
+  def _save_replay(self):
+    t = time.time()
+    replay_path = os.path.join(self._checkpoint_dir, 'replay_memory')
+    self._replay_memory.save(replay_path)
+    tprint("Saved replay memory to %s in %.1f seconds." %
+           (replay_path, time.time() - t))
 
   def _schedule_epsilon(self, steps):
     if steps < self._eps_decay_steps:
@@ -341,8 +304,69 @@ class DQNLearner(object):
     receiver = zmq_context.socket(zmq.REP)
     receiver.bind("tcp://*:%s" % port)
     while True:
-      assert receiver.recv_string() == "request model"
-      f = io.BytesIO()
-      torch.save(self._model_params, f)
-      receiver.send_pyobj(f.getvalue(), zmq.SNDMORE)
+      request = receiver.recv_string()
+      assert request in ("request model", "request numpy model")
+      if request == "request numpy model":
+        receiver.send_pyobj(to_numpy_params(self._model_params), zmq.SNDMORE)
+      else:
+        f = io.BytesIO()
+        torch.save(self._model_params, f)
+        receiver.send_pyobj(f.getvalue(), zmq.SNDMORE)
       receiver.send_pyobj(self._epsilon)
+
+
+class BatchPrefetcher(object):
+
+  def __init__(self, replay_memory, batch_size, num_threads=1, num_buffers=2):
+    assert num_buffers >= 2
+    self._replay_memory = replay_memory
+    self._batch_size = batch_size
+    self._num_threads = num_threads
+    self._buffers = [None] * num_buffers
+    self._free_ids = queue.Queue()
+    self._ready_ids = queue.Queue()
+    for buffer_id in range(num_buffers):
+      self._free_ids.put(buffer_id)
+
+  def start(self):
+    for _ in range(self._num_threads):
+      thread = Thread(target=self._prepare_batch)
+      thread.daemon = True
+      thread.start()
+
+  def get(self):
+    buffer_id = self._ready_ids.get()
+    return buffer_id, self._buffers[buffer_id]
+
+  def release(self, buffer_id):
+    self._free_ids.put(buffer_id)
+
+  def _prepare_batch(self):
+    while True:
+      buffer_id = self._free_ids.get()
+      transitions = self._replay_memory.sample(self._batch_size)
+      batch = Transition(*zip(*transitions))
+      if self._buffers[buffer_id] is None:
+        self._buffers[buffer_id] = self._allocate(batch)
+      observation, next_observation, action, reward, done, mc_return = \
+          self._buffers[buffer_id]
+      np.stack(batch.observation, out=observation.numpy())
+      np.stack(batch.next_observation, out=next_observation.numpy())
+      action.numpy()[:] = batch.action
+      reward.numpy()[:] = batch.reward
+      done.numpy()[:] = batch.done
+      mc_return.numpy()[:] = batch.mc_return
+      self._ready_ids.put(buffer_id)
+
+  def _allocate(self, batch):
+    observation = torch.from_numpy(np.stack(batch.observation))
+    next_observation = torch.from_numpy(np.stack(batch.next_observation))
+    buffers = (observation,
+               next_observation,
+               torch.LongTensor(self._batch_size),
+               torch.FloatTensor(self._batch_size),
+               torch.FloatTensor(self._batch_size),
+               torch.FloatTensor(self._batch_size))
+    if torch.cuda.is_available():
+      buffers = tuple(buf.pin_memory() for buf in buffers)
+    return buffers
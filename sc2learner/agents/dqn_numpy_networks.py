@@ -0,0 +1,183 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from gym import spaces
+
+
+def to_numpy_params(state_dict):
+  params = {}
+  for name, value in state_dict.items():
+    if name.startswith('module.'): name = name[len('module.'):]
+    if hasattr(value, 'cpu'): value = value.cpu().numpy()
+    params[name] = np.asarray(value)
+  return params
+
+
+def _relu(x):
+  return np.maximum(x, 0, out=x)
+
+
+def _conv2d(x, weight, bias, stride, padding):
+  n, c, h, w = x.shape
+  _, _, kh, kw = weight.shape
+  x = np.pad(x, ((0, 0), (0, 0), (padding, padding), (padding, padding)),
+             mode='constant')
+  out_h = (h + 2 * padding - kh) // stride + 1
+  out_w = (w + 2 * padding - kw) // stride + 1
+  sn, sc, sh, sw = x.strides
+  windows = np.lib.stride_tricks.as_strided(
+      x, shape=(n, c, kh, kw, out_h, out_w),
+      strides=(sn, sc, sh, sw, sh * stride, sw * stride))
+  out = np.tensordot(windows, weight, axes=([1, 2, 3], [1, 2, 3]))
+  out += bias
+  return np.ascontiguousarray(out.transpose(0, 3, 1, 2))
+
+
+class NumpyQNet(object):
+
+  def __init__(self, state_dict=None):
+    self._params = None
+    if state_dict is not None:
+      self.load_state_dict(state_dict)
+
+  def load_state_dict(self, state_dict):
+    params = to_numpy_params(state_dict)
+    self._params = {}
+    for name, value in params.items():
+      value = value.astype(np.float32)
+      # pre-transpose linear weights so that forward is a plain x.dot(w)
+      if name.endswith('.weight') and value.ndim == 2:
+        value = np.ascontiguousarray(value.T)
+      self._params[name] = value
+
+  def _linear(self, x, name):
+    out = x.dot(self._params[name + '.weight'])
+    out += self._params[name + '.bias']
+    return out
+
+  def _dueling(self, value, adv):
+    return value + adv - adv.mean(axis=1, keepdims=True)
+
+
+class NumpyNonspatialDuelingQNet(NumpyQNet):
+
+  def __call__(self, x):
+    x = np.asarray(x, dtype=np.float32)
+    value = _relu(self._linear(x, 'value_fc1'))
+    value = _relu(self._linear(value, 'value_fc2'))
+    value = _relu(self._linear(value, 'value_fc3'))
+    value = self._linear(value, 'value_fc4')
+
+    adv = _relu(self._linear(x, 'adv_fc1'))
+    adv = _relu(self._linear(adv, 'adv_fc2'))
+    adv = _relu(self._linear(adv, 'adv_fc3'))
+    adv = self._linear(adv, 'adv_fc4')
+    return self._dueling(value, adv)
+
+
+class NumpyDuelingQNet(NumpyQNet):
+
+  def __call__(self, x):
+    spatial, nonspatial = x
+    spatial = np.asarray(spatial, dtype=np.float32)
+    nonspatial = np.asarray(nonspatial, dtype=np.float32)
+    spatial = self._conv_block(spatial, 'conv1', 'bn1', 1, 2)
+    spatial = self._conv_block(spatial, 'conv2', 'bn2', 1, 1)
+    spatial = self._conv_block(spatial, 'conv3', 'bn3', 2, 1)
+    spatial = spatial.reshape(spatial.shape[0], -1)
+
+    value_sp_state = _relu(self._linear(spatial, 'value_sp_fc'))
+    value_nonsp_state = self.nonspatial_state(nonspatial, 'value')
+    value = self._linear(
+        np.concatenate((value_sp_state, value_nonsp_state), 1),
+        'value_final_fc')
+
+    adv_sp_state = _relu(self._linear(spatial, 'adv_sp_fc'))
+    adv_nonsp_state = self.nonspatial_state(nonspatial, 'adv')
+    adv = self._linear(
+        np.concatenate((adv_sp_state, adv_nonsp_state), 1), 'adv_final_fc')
+    return self._dueling(value, adv)
+
+  def nonspatial_state(self, nonspatial, head):
+    state = _relu(self._linear(nonspatial, head + '_nonsp_fc1'))
+    state = _relu(self._linear(state, head + '_nonsp_fc2'))
+    return _relu(self._linear(state, head + '_nonsp_fc3'))
+
+  def _conv_block(self, x, conv_name, bn_name, stride, padding):
+    x = _conv2d(x, self._params[conv_name + '.weight'],
+                self._params[conv_name + '.bias'], stride, padding)
+    if bn_name + '.running_mean' in self._params:
+      scale = self._params[bn_name + '.weight'] / np.sqrt(
+          self._params[bn_name + '.running_var'] + 1e-5)
+      shift = self._params[bn_name + '.bias'] - \
+          self._params[bn_name + '.running_mean'] * scale
+      x = x * scale[:, None, None] + shift[:, None, None]
+    return _relu(x)
+
+
+def numpy_network_of(network):
+  if isinstance(network, NumpyQNet): return network
+  name = type(network).__name__
+  if name == 'NonspatialDuelingQNet':
+    return NumpyNonspatialDuelingQNet(network.state_dict())
+  elif name == 'DuelingQNet':
+    return NumpyDuelingQNet(network.state_dict())
+  else:
+    raise ValueError("NumPy inference does not support network %s." % name)
+
+
+def verify_parity(network, numpy_network, observations, atol=1e-4):
+  import torch
+
+  network.eval()
+  if isinstance(observations, tuple):
+    inputs = tuple(torch.from_numpy(x) for x in observations)
+  else:
+    inputs = torch.from_numpy(observations)
+  with torch.no_grad():
+    expected = network(inputs).cpu().numpy()
+  max_diff = np.abs(numpy_network(observations) - expected).max()
+  assert max_diff <= atol, \
+      "NumPy network diverges from torch network by %f." % max_diff
+  return max_diff
+
+
+def _stack_observations(observations):
+  # spatial networks take (spatial, nonspatial) tuples, batched per component
+  if isinstance(observations[0], tuple):
+    return tuple(np.stack(component) for component in zip(*observations))
+  return np.stack(observations)
+
+
+class NumpyDQNAgent(object):
+
+  def __init__(self, network, action_space):
+    assert type(action_space) == spaces.Discrete
+    self._action_space = action_space
+    self._network = network
+
+  def act(self, observation, eps=0):
+    if np.random.uniform(0, 1) >= eps:
+      q = self._network(_stack_observations([observation]))
+      return int(q[0].argmax())
+    else:
+      return self._action_space.sample()
+
+  def act_batch(self, observations, eps):
+    num = len(observations)
+    explore = np.random.uniform(size=num) < np.asarray(eps)
+    actions = np.random.randint(self._action_space.n, size=num)
+    if not explore.all():
+      greedy_ids = np.nonzero(~explore)[0]
+      q = self._network(
+          _stack_observations([observations[i] for i in greedy_ids]))
+      actions[greedy_ids] = q.argmax(axis=1)
+    return actions.tolist()
+
+  def reset(self):
+    pass
+
+  def load_params(self, state_dict):
+    self._network.load_state_dict(state_dict)
@@ -5,9 +5,14 @@ from __future__ import print_function
 from collections import namedtuple
 from collections import deque
 from threading import Thread
+from threading import Lock
+import os
+import shutil
 import random
+import tempfile
 import time
 
+import numpy as np
 import zmq
 
 
@@ -52,6 +57,7 @@ class RemoteReplayMemory(object):
     if is_server:
       self._num_received, self._num_used, self._total = 0, 0, 0
       self._cache_blocks = deque(maxlen=memory_size // block_size)
+      self._lock = Lock()
       self._zmq_context = zmq.Context()
 
       self._receiver_threads = [Thread(target=self._server_proxy_worker,
@@ -83,14 +89,88 @@ class RemoteReplayMemory(object):
 
   def sample(self, batch_size, reuse_ratio=1.0):
     assert self._is_server, "sample() cannot be called when is_server=False."
-    while (self._num_used / reuse_ratio >= self._num_received or
-        self._memory_warmup_size > len(self._cache_blocks) * self._block_size):
+    # concurrent batch threads reserve their share of usage under the lock
+    while True:
+      with self._lock:
+        if (self._num_used / reuse_ratio < self._num_received and
+            self._memory_warmup_size <=
+            len(self._cache_blocks) * self._block_size):
+          self._num_used += batch_size
+          break
       time.sleep(0.001)
     batch = [random.choice(random.choice(self._cache_blocks))
              for _ in range(batch_size)]
-    self._num_used += batch_size
     return batch
 
+  def save(self, path):
+    assert self._is_server, "save() cannot be called when is_server=False."
+    with self._lock:
+      blocks = list(self._cache_blocks)
+      total = self._total
+    transitions = [t for block in blocks for t in block]
+    assert len(transitions) > 0, "Nothing to save in the replay memory."
+    # each snapshot goes to its own directory and becomes current once the
+    # pointer file is replaced, so a crash never leaves path without one
+    if not os.path.exists(path): os.makedirs(path)
+    snapshot_dir = tempfile.mkdtemp(prefix='snapshot-', dir=path)
+    for field in ('observation', 'next_observation'):
+      sample = np.asarray(getattr(transitions[0], field))
+      array = np.lib.format.open_memmap(
+          os.path.join(snapshot_dir, field + '.npy'), mode='w+',
+          dtype=sample.dtype, shape=(len(transitions),) + sample.shape)
+      start = 0
+      for block in blocks:
+        array[start:start + len(block)] = np.stack(
+            [getattr(t, field) for t in block])
+        start += len(block)
+      array.flush()
+      del array
+    np.savez(os.path.join(snapshot_dir, 'meta.npz'),
+             action=np.array([t.action for t in transitions]),
+             reward=np.array([t.reward for t in transitions]),
+             done=np.array([t.done for t in transitions]),
+             mc_return=np.array([t.mc_return for t in transitions]),
+             block_sizes=np.array([len(block) for block in blocks]),
+             total=np.array(total))
+    fd, tmp_path = tempfile.mkstemp(dir=path)
+    with os.fdopen(fd, 'w') as f:
+      f.write(os.path.basename(snapshot_dir))
+    os.replace(tmp_path, os.path.join(path, 'latest'))
+    for name in os.listdir(path):
+      if name.startswith('snapshot-') and \
+          name != os.path.basename(snapshot_dir):
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+  def load(self, path):
+    assert self._is_server, "load() cannot be called when is_server=False."
+    with open(os.path.join(path, 'latest')) as f:
+      path = os.path.join(path, f.read().strip())
+    observation = np.load(os.path.join(path, 'observation.npy'),
+                          mmap_mode='r')
+    next_observation = np.load(os.path.join(path, 'next_observation.npy'),
+                               mmap_mode='r')
+    meta = np.load(os.path.join(path, 'meta.npz'))
+    action = meta['action'].tolist()
+    reward = meta['reward'].tolist()
+    done = meta['done'].tolist()
+    mc_return = meta['mc_return'].tolist()
+    ranges, start = [], 0
+    for size in meta['block_sizes'].tolist():
+      ranges.append((start, start + size))
+      start += size
+    blocks = [[Transition(observation[i], action[i], reward[i],
+                          next_observation[i], done[i], mc_return[i])
+               for i in range(begin, end)]
+              for begin, end in ranges[-self._cache_blocks.maxlen:]]
+    num_loaded = sum(len(block) for block in blocks)
+    with self._lock:
+      cache_blocks = deque(blocks, maxlen=self._cache_blocks.maxlen)
+      cache_blocks.extend(self._cache_blocks)
+      self._cache_blocks = cache_blocks
+      self._total += int(meta['total'])
+      self._num_received += num_loaded
+    return num_loaded
+
   @property
   def total(self):
     if self._is_server:
@@ -103,9 +183,10 @@ class RemoteReplayMemory(object):
     receiver.connect("tcp://localhost:%s" % port)
     while True:
       block, delta = receiver.recv_pyobj()
-      self._cache_blocks.append(block)
-      self._total += delta
-      self._num_received += len(block)
+      with self._lock:
+        self._cache_blocks.append(block)
+        self._total += delta
+        self._num_received += len(block)
 
   def _server_proxy_worker(self, zmq_context, ports):
     assert len(ports) == 2
@@ -5,6 +5,7 @@ from __future__ import print_function
 import sys
 import random
 
+import numpy as np
 from absl import app
 from absl import flags
 from absl import logging
@@ -35,6 +36,8 @@ flags.DEFINE_boolean("disable_fog", False, "Disable fog-of-war.")
 flags.DEFINE_boolean("use_all_combat_actions", False, "Use all combat actions.")
 flags.DEFINE_boolean("use_region_features", False, "Use region features")
 flags.DEFINE_boolean("use_action_mask", True, "Use action mask or not.")
+flags.DEFINE_boolean("dqn_numpy_inference", False,
+                     "Run DQN agent's Q-network with NumPy.")
 flags.FLAGS(sys.argv)
 
 
@@ -45,7 +48,8 @@ def create_env(random_seed=None):
                   bot_race='zerg',
                   difficulty=FLAGS.difficulty,
                   disable_fog=FLAGS.disable_fog,
-                  random_seed=random_seed)
+                  random_seed=random_seed,
+                  raw_only=True)
   env = ZergActionWrapper(env,
                           game_version=FLAGS.game_version,
                           mask=FLAGS.use_action_mask,
@@ -69,6 +73,18 @@ def create_dqn_agent(env):
   network = NonspatialDuelingQNet(n_dims=env.observation_space.shape[0],
                                   n_out=env.action_space.n)
   agent = DQNAgent(network, env.action_space, FLAGS.model_path)
+  if FLAGS.dqn_numpy_inference:
+    from sc2learner.agents.dqn_numpy_networks import NumpyDQNAgent
+    from sc2learner.agents.dqn_numpy_networks import numpy_network_of
+    from sc2learner.agents.dqn_numpy_networks import verify_parity
+
+    network.cpu()
+    numpy_network = numpy_network_of(network)
+    observations = np.random.rand(
+        16, env.observation_space.shape[0]).astype(np.float32)
+    print("NumPy network max diff: %f" %
+          verify_parity(network, numpy_network, observations))
+    agent = NumpyDQNAgent(numpy_network, env.action_space)
   return agent
 
 
@@ -7,7 +7,6 @@ import os
 import random
 import time
 
-import torch
 from absl import app
 from absl import flags
 from absl import logging
@@ -16,9 +15,8 @@ from sc2learner.envs.raw_env import SC2RawEnv
 from sc2learner.envs.actions.zerg_action_wrappers import ZergActionWrapper
 from sc2learner.envs.observations.zerg_observation_wrappers \
     import ZergObservationWrapper
-from sc2learner.agents.dqn_agent import DQNActor
-from sc2learner.agents.dqn_agent import DQNLearner
-from sc2learner.agents.dqn_networks import NonspatialDuelingQNet
+from sc2learner.agents.dqn_actor import DQNActor
+from sc2learner.agents.dqn_actor import VecDQNActor
 from sc2learner.utils.utils import print_arguments
 
 
@@ -38,6 +36,13 @@ flags.DEFINE_integer("server_memory_warmup_size", 100000,
 flags.DEFINE_string("game_version", '4.6', "Game core version.")
 flags.DEFINE_float("discount", 0.995, "Discount factor.")
 flags.DEFINE_float("send_freq", 4.0, "Probability of a step being pushed.")
+flags.DEFINE_integer("num_actor_envs", 1, "Number of envs stepped per actor.")
+flags.DEFINE_float("actor_eps_alpha", 0.0,
+                   "Per-env epsilon exponent spread for batched actors.")
+flags.DEFINE_integer("actor_num_threads", 1,
+                     "Torch intra-op threads for batched actors.")
+flags.DEFINE_boolean("use_numpy_inference", False,
+                     "Run actor-side Q-network inference with NumPy.")
 flags.DEFINE_integer("step_mul", 32, "Game steps per agent step.")
 flags.DEFINE_string("difficulties", '1,2,4,6,9,A', "Bot's strengths.")
 flags.DEFINE_float("eps_start", 1.0, "Max greedy epsilon for exploration.")
@@ -48,16 +53,24 @@ flags.DEFINE_float("learning_rate", 1e-6, "Learning rate.")
 flags.DEFINE_float("adam_eps", 1e-7, "Adam optimizer's epsilon.")
 flags.DEFINE_float("gradient_clipping", 10.0, "Gradient clipping threshold.")
 flags.DEFINE_integer("batch_size", 256, "Batch size.")
+flags.DEFINE_integer("num_batch_threads", 1, "Threads preparing batches.")
+flags.DEFINE_integer("num_batch_buffers", 8, "Number of reusable batches.")
 flags.DEFINE_float("mmc_beta", 0.9, "Discount.")
 flags.DEFINE_integer("target_update_interval", 10000,
                      "Target net update interval.")
 flags.DEFINE_string("init_model_path", None, "Checkpoint to initialize model.")
+flags.DEFINE_string("init_replay_path", None,
+                    "Replay memory snapshot to initialize server memory.")
+flags.DEFINE_boolean("save_replay_memory", False,
+                     "Save a replay memory snapshot with each checkpoint.")
 flags.DEFINE_string("checkpoint_dir", "./checkpoints", "Dir to save models to")
 flags.DEFINE_integer("checkpoint_interval", 500000, "Model saving frequency.")
 flags.DEFINE_integer("print_interval", 10000, "Print train cost frequency.")
 flags.DEFINE_boolean("disable_fog", False, "Disable fog-of-war.")
 flags.DEFINE_boolean("use_all_combat_actions", False, "Use all combat actions.")
 flags.DEFINE_boolean("use_region_features", True, "Use region features")
+flags.DEFINE_string("expansion_cache_dir", None,
+                    "Directory caching expansion tables by map.")
 flags.FLAGS(sys.argv)
 
 
@@ -69,11 +82,13 @@ def create_env(difficulty, random_seed=None):
                    bot_race='zerg',
                    difficulty=difficulty,
                    disable_fog=FLAGS.disable_fog,
-                   random_seed=random_seed)
+                   random_seed=random_seed,
+                   raw_only=True)
   env = ZergActionWrapper(env,
                           game_version=FLAGS.game_version,
                           mask=False,
-                          use_all_combat_actions=FLAGS.use_all_combat_actions)
+                          use_all_combat_actions=FLAGS.use_all_combat_actions,
+                          expansion_cache_dir=FLAGS.expansion_cache_dir)
   env = ZergObservationWrapper(env,
                                use_spatial_features=False,
                                use_regions=FLAGS.use_region_features)
@@ -81,33 +96,57 @@ def create_env(difficulty, random_seed=None):
 
 
 def create_network(env):
+  from sc2learner.agents.dqn_networks import NonspatialDuelingQNet
   return NonspatialDuelingQNet(n_dims=env.observation_space.shape[0],
                                n_out=env.action_space.n)
 
 
 def start_actor_job():
   random.seed(time.time())
-  difficulty = random.choice(FLAGS.difficulties.split(','))
-  game_seed =  random.randint(0, 2**32 - 1)
-  print("Game Seed: %d Difficulty: %s" % (game_seed, difficulty))
-  env = create_env(difficulty, game_seed)
-  network = create_network(env)
-  actor = DQNActor(memory_size=FLAGS.client_memory_size,
-                   memory_warmup_size=FLAGS.client_memory_warmup_size,
-                   env=env,
-                   network=network,
-                   discount=FLAGS.discount,
-                   send_freq=FLAGS.send_freq,
-                   ports=FLAGS.ports.split(','),
-                   learner_ip=FLAGS.learner_ip)
+  envs = []
+  for _ in range(FLAGS.num_actor_envs):
+    difficulty = random.choice(FLAGS.difficulties.split(','))
+    game_seed =  random.randint(0, 2**32 - 1)
+    print("Game Seed: %d Difficulty: %s" % (game_seed, difficulty))
+    envs.append(create_env(difficulty, game_seed))
+  if FLAGS.use_numpy_inference:
+    # parameters are fetched from the learner before the first rollout
+    from sc2learner.agents.dqn_numpy_networks import NumpyNonspatialDuelingQNet
+    network = NumpyNonspatialDuelingQNet()
+  else:
+    network = create_network(envs[0])
+  if FLAGS.num_actor_envs > 1:
+    actor = VecDQNActor(memory_size=FLAGS.client_memory_size,
+                        memory_warmup_size=FLAGS.client_memory_warmup_size,
+                        envs=envs,
+                        network=network,
+                        discount=FLAGS.discount,
+                        send_freq=FLAGS.send_freq,
+                        eps_alpha=FLAGS.actor_eps_alpha,
+                        num_threads=FLAGS.actor_num_threads,
+                        ports=FLAGS.ports.split(','),
+                        learner_ip=FLAGS.learner_ip,
+                        use_numpy_inference=FLAGS.use_numpy_inference)
+  else:
+    actor = DQNActor(memory_size=FLAGS.client_memory_size,
+                     memory_warmup_size=FLAGS.client_memory_warmup_size,
+                     env=envs[0],
+                     network=network,
+                     discount=FLAGS.discount,
+                     send_freq=FLAGS.send_freq,
+                     ports=FLAGS.ports.split(','),
+                     learner_ip=FLAGS.learner_ip,
+                     use_numpy_inference=FLAGS.use_numpy_inference)
   actor.run()
-  env.close()
+  for env in envs: env.close()
 
 
 def start_learner_job():
   if not os.path.exists(FLAGS.checkpoint_dir):
     os.makedirs(FLAGS.checkpoint_dir)
 
+  from sc2learner.agents.dqn_agent import DQNLearner
+
   env = create_env('1', 0)
   network = create_network(env)
   learner = DQNLearner(network=network,
@@ -129,7 +168,11 @@ def start_learner_job():
                        checkpoint_interval=FLAGS.checkpoint_interval,
                        print_interval=FLAGS.print_interval,
                        ports=FLAGS.ports.split(','),
-                       init_model_path=FLAGS.init_model_path)
+                       init_model_path=FLAGS.init_model_path,
+                       init_replay_path=FLAGS.init_replay_path,
+                       save_replay_memory=FLAGS.save_replay_memory,
+                       num_batch_threads=FLAGS.num_batch_threads,
+                       num_batch_buffers=FLAGS.num_batch_buffers)
   learner.run()
   env.close()
 
@@ -40,6 +40,9 @@ flags.DEFINE_float("vf_coef", 0.5, "Coefficient for the value loss.")
 flags.DEFINE_float("learn_act_speed_ratio", 0, "Maximum learner/actor ratio.")
 flags.DEFINE_integer("batch_size", 32, "Batch size.")
 flags.DEFINE_integer("game_steps_per_episode", 43200, "Maximum steps per episode.")
+flags.DEFINE_integer("prepare_game_loops", 0,
+                     "Launch the next game this many game loops before the "
+                     "episode limit; 0 restarts the finished game instead.")
 flags.DEFINE_integer("learner_queue_size", 1024, "Size of learner's unroll queue.")
 flags.DEFINE_integer("step_mul", 32, "Game steps per agent step.")
 flags.DEFINE_string("difficulties", '1,2,4,6,9,A', "Bot's strengths.")
@@ -53,6 +56,8 @@ flags.DEFINE_boolean("use_all_combat_actions", False, "Use all combat actions.")
 flags.DEFINE_boolean("use_region_features", False, "Use region features")
 flags.DEFINE_boolean("use_action_mask", True, "Use region-wise combat.")
 flags.DEFINE_boolean("use_reward_shaping", False, "Use reward shaping.")
+flags.DEFINE_string("expansion_cache_dir", None,
+                    "Directory caching expansion tables by map.")
 flags.FLAGS(sys.argv)
 
 
@@ -77,12 +82,15 @@ def create_env(difficulty, random_seed=None):
                   disable_fog=FLAGS.disable_fog,
                   tie_to_lose=False,
                   game_steps_per_episode=FLAGS.game_steps_per_episode,
-                  random_seed=random_seed)
+                  random_seed=random_seed,
+                  raw_only=True,
+                  prepare_game_loops=FLAGS.prepare_game_loops)
   if FLAGS.use_reward_shaping: env = KillingRewardWrapper(env)
   env = ZergActionWrapper(env,
                           game_version=FLAGS.game_version,
                           mask=FLAGS.use_action_mask,
-                          use_all_combat_actions=FLAGS.use_all_combat_actions)
+                          use_all_combat_actions=FLAGS.use_all_combat_actions,
+                          expansion_cache_dir=FLAGS.expansion_cache_dir)
   env = ZergObservationWrapper(env,
                                use_spatial_features=False,
                                use_game_progress=(not FLAGS.policy == 'lstm'),
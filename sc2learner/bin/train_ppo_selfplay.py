@@ -45,6 +45,9 @@ flags.DEFINE_float("ent_coef", 0.01, "Coefficient for the entropy term.")
 flags.DEFINE_float("vf_coef", 0.5, "Coefficient for the value loss.")
 flags.DEFINE_float("learn_act_speed_ratio", 0, "Maximum learner/actor ratio.")
 flags.DEFINE_integer("game_steps_per_episode", 43200, "Maximum steps per episode.")
+flags.DEFINE_integer("prepare_game_loops", 0,
+                     "Launch the next game this many game loops before the "
+                     "episode limit; 0 restarts the finished game instead.")
 flags.DEFINE_integer("batch_size", 32, "Batch size.")
 flags.DEFINE_integer("learner_queue_size", 1024, "Size of learner's unroll queue.")
 flags.DEFINE_integer("step_mul", 32, "Game steps per agent step.")
@@ -83,7 +86,9 @@ def create_env(difficulty, random_seed=None):
                   disable_fog=FLAGS.disable_fog,
                   tie_to_lose=False,
                   game_steps_per_episode=FLAGS.game_steps_per_episode,
-                  random_seed=random_seed)
+                  random_seed=random_seed,
+                  raw_only=True,
+                  prepare_game_loops=FLAGS.prepare_game_loops)
   env = ZergActionWrapper(env,
                           game_version=FLAGS.game_version,
                           mask=FLAGS.use_action_mask,
@@ -106,7 +111,9 @@ def create_selfplay_env(random_seed=None):
                           tie_to_lose=False,
                           disable_fog=FLAGS.disable_fog,
                           game_steps_per_episode=FLAGS.game_steps_per_episode,
-                          random_seed=random_seed)
+                          random_seed=random_seed,
+                          raw_only=True,
+                          prepare_game_loops=FLAGS.prepare_game_loops)
   env = ZergPlayerActionWrapper(
       player=0,
       env=env,
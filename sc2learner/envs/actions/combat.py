@@ -4,21 +4,70 @@ from __future__ import print_function
 
 from collections import namedtuple
 
+import numpy as np
 from s2clientprotocol import sc2api_pb2 as sc_pb
 from pysc2.lib.typeenums import UNIT_TYPEID as UNIT_TYPE
 from pysc2.lib.typeenums import ABILITY_ID as ABILITY
 from pysc2.lib.typeenums import UPGRADE_ID as UPGRADE
 
 from sc2learner.envs.actions.function import Function
-import sc2learner.envs.common.utils as utils
 from sc2learner.envs.common.const import ATTACK_FORCE
 from sc2learner.envs.common.const import ALLY_TYPE
+from sc2learner.envs.common.const import COMBAT_TYPES
 from sc2learner.envs.common.const import PRIORITIZED_ATTACK
 
 
 Region = namedtuple('Region', ('ranges', 'rally_point_a', 'rally_point_b'))
 
 
+class AttackTaskTable(object):
+
+  def __init__(self):
+    self._tags = np.zeros(0, dtype=np.uint64)
+    self._region_ids = np.zeros(0, dtype=np.int64)
+
+  def __len__(self):
+    return len(self._tags)
+
+  def clear(self):
+    self.__init__()
+
+  def assign(self, tags, region_id):
+    tags = np.asarray(tags, dtype=np.uint64)
+    if len(tags) == 0: return
+    tags = np.concatenate((self._tags, tags))
+    region_ids = np.concatenate(
+        (self._region_ids, np.full(len(tags) - len(self._tags), region_id,
+                                   dtype=np.int64)))
+    # the latest assignment of a tag wins
+    order = np.argsort(tags, kind='stable')
+    tags, region_ids = tags[order], region_ids[order]
+    last = np.ones(len(tags), dtype=bool)
+    last[:-1] = tags[1:] != tags[:-1]
+    self._tags, self._region_ids = tags[last], region_ids[last]
+
+  def prune(self, live_tags):
+    alive = np.isin(self._tags, live_tags)
+    if not alive.all():
+      self._tags, self._region_ids = self._tags[alive], self._region_ids[alive]
+
+  def lookup(self, tags):
+    if len(self._tags) == 0: return np.full(len(tags), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(self._tags, tags), len(self._tags) - 1)
+    return np.where(self._tags[pos] == tags, self._region_ids[pos], -1)
+
+  def group(self, tags):
+    # positions of tags assigned to each region, in their original order
+    region_ids = self.lookup(tags)
+    order = np.argsort(region_ids, kind='stable')
+    region_ids = region_ids[order]
+    regions, starts = np.unique(region_ids, return_index=True)
+    ends = np.append(starts[1:], len(region_ids))
+    return [(region_id, order[start:end])
+            for region_id, start, end in zip(regions.tolist(), starts, ends)
+            if region_id >= 0]
+
+
 class CombatActions(object):
 
   def __init__(self):
@@ -35,8 +84,19 @@ class CombatActions(object):
         Region([(120, 0, 200, 55)], (133, 36), (133, 36))
     ]
     self._flip_region = lambda r_id: 10 - r_id if r_id > 0 else r_id
-
-    self._attack_tasks = {}
+    # bit r of a cell is set when the cell lies in region r
+    self._region_raster = np.zeros(
+        (max(r[2] for region in self._regions for r in region.ranges),
+         max(r[3] for region in self._regions for r in region.ranges)),
+        dtype=np.int32)
+    for region_id, region in enumerate(self._regions):
+      for r in region.ranges:
+        self._region_raster[r[0]:r[2], r[1]:r[3]] |= 1 << region_id
+
+    self._attack_tasks = AttackTaskTable()
+    self._combat_types = np.array(sorted(COMBAT_TYPES), dtype=np.int64)
+    self._prioritized_types = np.array(sorted(PRIORITIZED_ATTACK),
+                                       dtype=np.int64)
 
   def reset(self):
     self._attack_tasks.clear()
@@ -73,8 +133,9 @@ class CombatActions(object):
       flip = True if self._player_position(dc) == 0  else False
       src_id = self._flip_region(source_region_id) if flip else source_region_id
       tgt_id = self._flip_region(target_region_id) if flip else target_region_id
-      combat_unit = [u for u in dc.combat_units if self._is_in_region(u, src_id)]
-      self._set_attack_task(combat_unit, tgt_id)
+      combat_ids, region_bits = self._combat_region_bits(dc)
+      unit_ids = combat_ids[(region_bits >> src_id) & 1 > 0]
+      self._attack_tasks.assign(dc.unit_table.tag[unit_ids], tgt_id)
       return []
 
     return act
@@ -84,8 +145,8 @@ class CombatActions(object):
     def is_valid(dc):
       flip = True if self._player_position(dc) == 0  else False
       src_id = self._flip_region(source_region_id) if flip else source_region_id
-      combat_unit = [u for u in dc.combat_units if self._is_in_region(u, src_id)]
-      return len(combat_unit) >= 3
+      _, region_bits = self._combat_region_bits(dc)
+      return np.count_nonzero((region_bits >> src_id) & 1) >= 3
 
     return is_valid
 
@@ -103,87 +164,57 @@ class CombatActions(object):
     else: return False
 
   def _framewise_rally_and_attack(self, dc):
+    table = dc.unit_table
+    combat_ids, _ = self._combat_region_bits(dc)
+    enemy_ids = table.indices(table.alliance == ALLY_TYPE.ENEMY.value)
+    enemy_region_bits = self._region_bits(table, enemy_ids)
+    self._attack_tasks.prune(table.tag)
     actions = []
-    for region_id in range(len(self._regions)):
-      units_with_task = [u for u in dc.combat_units
-                         if (u.tag in self._attack_tasks and
-                             self._attack_tasks[u.tag] == region_id)]
-      if len(units_with_task) > 0:
-        target_enemies = [
-            u for u in dc.units_of_alliance(ALLY_TYPE.ENEMY.value)
-            if self._is_in_region(u, region_id)
-        ]
-        if len(target_enemies) > 0:
-          actions.extend(
-              self._micro_attack(units_with_task, target_enemies, dc))
+    for region_id, group in self._attack_tasks.group(table.tag[combat_ids]):
+      unit_ids = combat_ids[group]
+      target_ids = enemy_ids[(enemy_region_bits >> region_id) & 1 > 0]
+      if len(target_ids) > 0:
+        actions.extend(self._micro_attack(unit_ids, target_ids, dc))
+      else:
+        if self._player_position(dc) == 0:
+          rally_point = self._regions[region_id].rally_point_a
         else:
-          if self._player_position(dc) == 0:
-            rally_point = self._regions[region_id].rally_point_a
-          else:
-            rally_point = self._regions[region_id].rally_point_b
-          actions.extend(self._micro_rally(units_with_task, rally_point, dc))
+          rally_point = self._regions[region_id].rally_point_b
+        actions.extend(self._micro_rally(table.units_at(unit_ids),
+                                         rally_point, dc))
     return actions
 
-  def _micro_attack(self, combat_units, enemy_units, dc):
+  def _micro_attack(self, combat_ids, enemy_ids, dc):
+    table = dc.unit_table
+    attack_attrs = [ATTACK_FORCE[t]
+                    for t in table.unit_type[combat_ids].tolist()]
+    can_attack_air = np.array([a.can_attack_air for a in attack_attrs],
+                              dtype=bool)
+    can_attack_ground = np.array([a.can_attack_ground for a in attack_attrs],
+                                 dtype=bool)
+    is_flying = table.is_flying[enemy_ids]
+    is_prioritized = np.isin(table.unit_type[enemy_ids],
+                             self._prioritized_types)
+    diff = table.positions[combat_ids][:, None, :] - \
+        table.positions[enemy_ids][None, :, :]
+    dist = np.sqrt(diff[:, :, 0] * diff[:, :, 0] +
+                   diff[:, :, 1] * diff[:, :, 1])
 
-    def prioritized_attack(unit, target_units):
-      assert len(target_units) > 0
-      prioritized_target_units = [u for u in target_units
-                                  if u.unit_type in PRIORITIZED_ATTACK]
-      if len(prioritized_target_units) > 0:
-        closest_target = utils.closest_unit(unit, prioritized_target_units)
-      else:
-        closest_target = utils.closest_unit(unit, target_units)
-      target_pos = (closest_target.float_attr.pos_x,
-                    closest_target.float_attr.pos_y)
-      return self._unit_attack(unit, target_pos, dc)
-
-    def flee_or_fight(unit, target_units):
-      assert len(target_units) > 0
-      closest_target = utils.closest_unit(unit, target_units)
-      closest_dist = utils.closest_distance(unit, enemy_units)
-      strongest_health = utils.strongest_health(combat_units)
-      if (closest_dist < 5.0 and
-          unit.float_attr.health / unit.float_attr.health_max < 0.3 and
-          strongest_health > 0.9):
-        x = unit.float_attr.pos_x + (unit.float_attr.pos_x - \
-            closest_target.float_attr.pos_x) * 0.2
-        y = unit.float_attr.pos_y + (unit.float_attr.pos_y - \
-            closest_target.float_attr.pos_y) * 0.2
-        target_pos = (x, y)
-        return self._unit_move(unit, target_pos, dc)
-      else:
-        target_pos = (closest_target.float_attr.pos_x,
-                      closest_target.float_attr.pos_y)
-        return self._unit_attack(unit, target_pos, dc)
-
-    air_combat_units = [
-        u for u in combat_units
-        if (ATTACK_FORCE[u.unit_type].can_attack_air and
-            not ATTACK_FORCE[u.unit_type].can_attack_ground)
-    ]
-    ground_combat_units = [
-        u for u in combat_units
-        if (not ATTACK_FORCE[u.unit_type].can_attack_air and
-            ATTACK_FORCE[u.unit_type].can_attack_ground)
-    ]
-    air_ground_combat_units = [
-        u for u in combat_units
-        if (ATTACK_FORCE[u.unit_type].can_attack_air and
-            ATTACK_FORCE[u.unit_type].can_attack_ground)
-    ]
-    air_enemy_units = [u for u in enemy_units if u.bool_attr.is_flying]
-    ground_enemy_units = [u for u in enemy_units if not u.bool_attr.is_flying]
     actions = []
-    for unit in air_combat_units:
-      if len(air_enemy_units) > 0:
-        actions.extend(prioritized_attack(unit, air_enemy_units))
-    for unit in ground_combat_units:
-      if len(ground_enemy_units) > 0:
-        actions.extend(prioritized_attack(unit, ground_enemy_units))
-    for unit in air_ground_combat_units:
-      if len(enemy_units) > 0:
-        actions.extend(prioritized_attack(unit, enemy_units))
+    for unit_mask, target_mask in [
+        (can_attack_air & ~can_attack_ground, is_flying),
+        (~can_attack_air & can_attack_ground, ~is_flying),
+        (can_attack_air & can_attack_ground, np.ones_like(is_flying))]:
+      if not unit_mask.any() or not target_mask.any(): continue
+      # prefer prioritized targets whenever the target group has any
+      if (target_mask & is_prioritized).any():
+        target_mask = target_mask & is_prioritized
+      targets = enemy_ids[np.where(target_mask, dist[unit_mask],
+                                   np.inf).argmin(axis=1)]
+      for unit, x, y in zip(table.units_at(combat_ids[unit_mask]),
+                            table.pos_x[targets].tolist(),
+                            table.pos_y[targets].tolist()):
+        actions.extend(self._unit_attack(unit, (x, y), dc))
     return actions
 
   def _micro_rally(self, units, rally_point, dc):
@@ -232,9 +263,8 @@ class CombatActions(object):
 
   def _roach_unit_attack(self, unit, target_pos, dc):
     actions = []
-    ground_enemies = [u for u in dc.units_of_alliance(ALLY_TYPE.ENEMY.value)
-                      if not u.bool_attr.is_flying]
-    if len(utils.units_nearby(unit, ground_enemies, max_distance=4)) > 0:
+    ground_enemies = dc.spatial_index(ALLY_TYPE.ENEMY.value, is_flying=False)
+    if self._any_nearby(unit, ground_enemies, max_distance=4):
       if unit.unit_type == UNIT_TYPE.ZERG_ROACHBURROWED.value:
         action = sc_pb.Action()
         action.action_raw.unit_command.unit_tags.append(unit.tag)
@@ -259,9 +289,8 @@ class CombatActions(object):
 
   def _lurker_unit_attack(self, unit, target_pos, dc):
     actions = []
-    ground_enemies = [u for u in dc.units_of_alliance(ALLY_TYPE.ENEMY.value)
-                      if not u.bool_attr.is_flying]
-    if len(utils.units_nearby(unit, ground_enemies, max_distance=8)) > 0:
+    ground_enemies = dc.spatial_index(ALLY_TYPE.ENEMY.value, is_flying=False)
+    if self._any_nearby(unit, ground_enemies, max_distance=8):
       if unit.unit_type == UNIT_TYPE.ZERG_LURKERMP.value:
         action = sc_pb.Action()
         action.action_raw.unit_command.unit_tags.append(unit.tag)
@@ -284,9 +313,8 @@ class CombatActions(object):
 
   def _ravager_unit_attack(self, unit, target_pos, dc):
     actions = []
-    ground_units = [u for u in dc.units_of_alliance(ALLY_TYPE.SELF.value)
-                    if not u.bool_attr.is_flying]
-    if len(utils.units_nearby(target_pos, ground_units, max_distance=2)) == 0:
+    ground_units = dc.spatial_index(ALLY_TYPE.SELF.value, is_flying=False)
+    if not self._any_nearby(target_pos, ground_units, max_distance=2):
       action = sc_pb.Action()
       action.action_raw.unit_command.unit_tags.append(unit.tag)
       action.action_raw.unit_command.ability_id = \
@@ -297,16 +325,35 @@ class CombatActions(object):
     actions.extend(self._normal_unit_attack(unit, target_pos))
     return actions
 
+  def _any_nearby(self, unit_or_pos, index, max_distance):
+    pos = (unit_or_pos.float_attr.pos_x, unit_or_pos.float_attr.pos_y) \
+        if hasattr(unit_or_pos, 'float_attr') else unit_or_pos
+    return index.count_within([pos], max_distance)[0] > 0
+
   def _set_attack_task(self, units, target_region_id):
-    for u in units:
-      self._attack_tasks[u.tag] = target_region_id
-
-  def _is_in_region(self, unit, region_id):
-    return any([(unit.float_attr.pos_x >= r[0] and
-                 unit.float_attr.pos_x < r[2] and
-                 unit.float_attr.pos_y >= r[1] and
-                 unit.float_attr.pos_y < r[3])
-                for r in self._regions[region_id].ranges])
+    self._attack_tasks.assign([u.tag for u in units], target_region_id)
+
+  def _combat_region_bits(self, dc):
+
+    def compute():
+      table = dc.unit_table
+      combat_ids = table.indices(
+          np.isin(table.unit_type, self._combat_types) &
+          (table.alliance == ALLY_TYPE.SELF.value))
+      return combat_ids, self._region_bits(table, combat_ids)
+
+    return dc.cached(('combat_region_bits', id(self)), compute)
+
+  def _region_bits(self, table, ids):
+    # region bounds are integers, so the floored position decides membership
+    x = np.floor(table.pos_x[ids])
+    y = np.floor(table.pos_y[ids])
+    width, height = self._region_raster.shape
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    bits = np.zeros(len(ids), dtype=self._region_raster.dtype)
+    bits[inside] = self._region_raster[x[inside].astype(np.int64),
+                                       y[inside].astype(np.int64)]
+    return bits
 
   def _player_position(self, dc):
     if dc.init_base_pos[0] < 100: return 0
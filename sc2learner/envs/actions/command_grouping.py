@@ -0,0 +1,50 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from pysc2.lib.typeenums import ABILITY_ID as ABILITY
+
+
+# abilities every selected unit executes; spells like corrosive bile or
+# inject larva are smart cast by a single unit of a multi-unit command
+GROUPABLE_ABILITIES = {ABILITY.ATTACK_ATTACK.value,
+                       ABILITY.MOVE.value,
+                       ABILITY.HARVEST_GATHER_DRONE.value,
+                       ABILITY.RALLY_UNITS.value,
+                       ABILITY.RALLY_WORKERS.value}
+
+
+def _command_key(action):
+  if [f.name for f, _ in action.ListFields()] != ['action_raw']: return None
+  if [f.name for f, _ in action.action_raw.ListFields()] != ['unit_command']:
+    return None
+  command = action.action_raw.unit_command
+  if command.ability_id not in GROUPABLE_ABILITIES: return None
+  target = command.WhichOneof('target')
+  if target == 'target_world_space_pos':
+    value = (command.target_world_space_pos.x,
+             command.target_world_space_pos.y)
+  elif target == 'target_unit_tag':
+    value = command.target_unit_tag
+  else:
+    value = None
+  return (command.ability_id, target, value, command.queue_command)
+
+
+def group_unit_commands(actions):
+  grouped, open_groups, last_group_of = [], {}, {}
+  for action in actions:
+    key = _command_key(action)
+    tags = list(action.action_raw.unit_command.unit_tags)
+    group_id = open_groups.get(key)
+    # joining an earlier group must not reorder commands of the same unit
+    if (group_id is not None and
+        all(last_group_of.get(tag, -1) < group_id for tag in tags)):
+      grouped[group_id].action_raw.unit_command.unit_tags.extend(tags)
+    else:
+      group_id = len(grouped)
+      grouped.append(action)
+      if key is not None: open_groups[key] = group_id
+    for tag in tags:
+      last_group_of[tag] = group_id
+  return grouped, len(actions) - len(grouped)
@@ -5,4 +5,6 @@ from __future__ import print_function
 from collections import namedtuple
 
 
-Function = namedtuple('Function', ['name', 'function', 'is_valid'])
+Function = namedtuple('Function',
+                      ['name', 'function', 'is_valid', 'requirement'])
+Function.__new__.__defaults__ = (None,)
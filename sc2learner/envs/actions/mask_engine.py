@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import namedtuple
+
+import numpy as np
+
+
+Requirement = namedtuple('Requirement', ('required_units',
+                                         'required_upgrades',
+                                         'mineral_cost',
+                                         'gas_cost',
+                                         'supply_cost',
+                                         'builders',
+                                         'idle_builders',
+                                         'build_ability',
+                                         'no_pending_task',
+                                         'quota',
+                                         'upgrade_id',
+                                         'predicate'))
+
+
+def is_satisfied(req, dc):
+  if (len(req.required_units) > 0 and
+      not any(dc.num_mature_units_of_type(t) > 0 for t in req.required_units)):
+    return False
+  if not all(t in dc.upgraded_techs for t in req.required_upgrades):
+    return False
+  if req.upgrade_id is not None and req.upgrade_id in dc.upgraded_techs:
+    return False
+  if req.no_pending_task and dc.num_units_with_task(req.build_ability) > 0:
+    return False
+  if req.quota is not None:
+    type_id, max_num = req.quota
+    if (dc.num_units_of_type(type_id) +
+        dc.num_units_with_task(req.build_ability) >= max_num):
+      return False
+  if (dc.mineral_count < req.mineral_cost or
+      dc.gas_count < req.gas_cost or
+      dc.supply_count < req.supply_cost):
+    return False
+  if req.idle_builders:
+    num_builders = sum(dc.num_idle_units_of_type(t) for t in req.builders)
+  else:
+    num_builders = sum(dc.num_units_of_type(t) for t in req.builders)
+  if num_builders == 0:
+    return False
+  return req.predicate is None or req.predicate(dc)
+
+
+class ActionMaskEngine(object):
+
+  def __init__(self, functions):
+    self._functions = functions
+    self._rule_ids = [i for i, f in enumerate(functions)
+                      if f.requirement is not None]
+    self._other_ids = [i for i, f in enumerate(functions)
+                       if f.requirement is None]
+    reqs = [functions[i].requirement for i in self._rule_ids]
+
+    type_ids = sorted(set(
+        [t for r in reqs for t in r.required_units + r.builders] +
+        [r.quota[0] for r in reqs if r.quota is not None]))
+    upgrade_ids = sorted(set(
+        [t for r in reqs for t in r.required_upgrades] +
+        [r.upgrade_id for r in reqs if r.upgrade_id is not None]))
+    ability_ids = sorted(set(r.build_ability for r in reqs))
+    self._type_ids, self._upgrade_ids = type_ids, upgrade_ids
+    self._ability_ids = ability_ids
+    type_idx = {t: i for i, t in enumerate(type_ids)}
+    upgrade_idx = {t: i for i, t in enumerate(upgrade_ids)}
+    ability_idx = {t: i for i, t in enumerate(ability_ids)}
+
+    n = len(reqs)
+    self._required_units = np.zeros((n, len(type_ids)), dtype=np.int32)
+    self._required_upgrades = np.zeros((n, len(upgrade_ids)), dtype=np.int32)
+    self._builders = np.zeros((n, len(type_ids)), dtype=np.int32)
+    self._idle_builders = np.array([r.idle_builders for r in reqs], dtype=bool)
+    self._costs = np.array([[r.mineral_cost, r.gas_cost, r.supply_cost]
+                            for r in reqs], dtype=np.float64).reshape(n, 3)
+    self._ability = np.array([ability_idx[r.build_ability] for r in reqs],
+                             dtype=np.int32)
+    self._no_pending_task = np.array([r.no_pending_task for r in reqs],
+                                     dtype=bool)
+    self._has_quota = np.array([r.quota is not None for r in reqs], dtype=bool)
+    self._quota_type = np.array(
+        [type_idx[r.quota[0]] if r.quota is not None else 0 for r in reqs],
+        dtype=np.int32)
+    self._quota_num = np.array(
+        [r.quota[1] if r.quota is not None else 0 for r in reqs],
+        dtype=np.int64)
+    self._has_upgrade_id = np.array([r.upgrade_id is not None for r in reqs],
+                                    dtype=bool)
+    self._upgrade_id = np.array(
+        [upgrade_idx[r.upgrade_id] if r.upgrade_id is not None else 0
+         for r in reqs], dtype=np.int32)
+    for i, r in enumerate(reqs):
+      self._required_units[i, [type_idx[t] for t in r.required_units]] = 1
+      self._required_upgrades[i, [upgrade_idx[t]
+                                  for t in r.required_upgrades]] = 1
+      self._builders[i, [type_idx[t] for t in r.builders]] = 1
+    self._no_required_units = self._required_units.sum(axis=1) == 0
+    self._predicates = [r.predicate for r in reqs]
+
+  def valid_mask(self, dc):
+    mask = np.zeros(len(self._functions))
+    if len(self._rule_ids) > 0:
+      rule_mask = self._rule_mask(dc)
+      for i in np.nonzero(rule_mask)[0]:
+        predicate = self._predicates[i]
+        if predicate is None or predicate(dc):
+          mask[self._rule_ids[i]] = 1
+    for i in self._other_ids:
+      if self._functions[i].is_valid(dc):
+        mask[i] = 1
+    return mask
+
+  def _rule_mask(self, dc):
+    num_units = np.array([dc.num_units_of_type(t) for t in self._type_ids],
+                         dtype=np.int64)
+    num_mature = np.array(
+        [dc.num_mature_units_of_type(t) for t in self._type_ids],
+        dtype=np.int64)
+    num_idle = np.array([dc.num_idle_units_of_type(t) for t in self._type_ids],
+                        dtype=np.int64)
+    num_tasks = np.array(
+        [dc.num_units_with_task(a) for a in self._ability_ids], dtype=np.int64)
+    upgraded_techs = dc.upgraded_techs
+    missing_upgrades = np.array(
+        [t not in upgraded_techs for t in self._upgrade_ids], dtype=np.int32)
+    resources = np.array([dc.mineral_count, dc.gas_count, dc.supply_count],
+                         dtype=np.float64)
+
+    has_required_units = np.logical_or(
+        self._no_required_units,
+        self._required_units.dot(num_mature > 0) > 0)
+    has_required_upgrades = \
+        self._required_upgrades.dot(missing_upgrades) == 0
+    not_upgraded = np.logical_or(~self._has_upgrade_id,
+                                 missing_upgrades[self._upgrade_id] > 0) \
+        if len(self._upgrade_ids) > 0 else np.ones_like(self._has_quota)
+    tasks = num_tasks[self._ability]
+    not_pending = np.logical_or(~self._no_pending_task, tasks == 0)
+    not_overquota = np.logical_or(
+        ~self._has_quota,
+        num_units[self._quota_type] + tasks < self._quota_num) \
+        if len(self._type_ids) > 0 else np.ones_like(self._has_quota)
+    affordable = np.all(self._costs <= resources, axis=1)
+    builders = np.where(self._idle_builders,
+                        self._builders.dot(num_idle),
+                        self._builders.dot(num_units))
+    return (has_required_units & has_required_upgrades & not_upgraded &
+            not_pending & not_overquota & affordable & (builders > 0))
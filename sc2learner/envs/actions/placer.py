@@ -2,8 +2,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
 import random
 import math
+import tempfile
 
 import numpy as np
 from pysc2.lib.typeenums import UNIT_TYPEID as UNIT_TYPE
@@ -12,8 +14,209 @@ import sc2learner.envs.common.utils as utils
 from sc2learner.envs.common.const import PLACE_COLLISION_BUILDINGS
 
 
+MINERAL_TYPES = {UNIT_TYPE.NEUTRAL_MINERALFIELD.value,
+                 UNIT_TYPE.NEUTRAL_MINERALFIELD750.value}
+SLOPES = [(76.5, 90.5), (73.5, 86.5), (123.5, 52.5), (126.5, 56.5),
+          (131.5, 36.5), (68.5, 106.5)]
+HOLES = [(124.5, 34.5), (76.5, 108.5), (154.5, 60.5), (45.5, 82.5)]
+GRID_PADDING = 32
+GRID_SIZE = 256 + GRID_PADDING * 2
+
+_EXPANSION_TABLES = {}
+_CORNER_MASKS = {}
+
+
+def _stamp_rects(grid, rects, values, offset=(GRID_PADDING, GRID_PADDING)):
+  # adds each [xl, xr) x [yl, yr) rect at once through a 2d difference array
+  rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+  if len(rects) == 0: return
+  values = np.broadcast_to(np.asarray(values, dtype=grid.dtype), len(rects))
+  w, h = grid.shape
+  xl = np.clip(rects[:, 0] + offset[0], 0, w)
+  xr = np.clip(rects[:, 1] + offset[0], 0, w)
+  yl = np.clip(rects[:, 2] + offset[1], 0, h)
+  yr = np.clip(rects[:, 3] + offset[1], 0, h)
+  keep = (xr > xl) & (yr > yl)
+  xl, xr, yl, yr, values = xl[keep], xr[keep], yl[keep], yr[keep], \
+      values[keep]
+  diff = np.zeros((w + 1, h + 1), dtype=grid.dtype)
+  np.add.at(diff, (xl, yl), values)
+  np.add.at(diff, (xr, yl), -values)
+  np.add.at(diff, (xl, yr), -values)
+  np.add.at(diff, (xr, yr), values)
+  grid += diff.cumsum(axis=0).cumsum(axis=1)[:w, :h]
+
+
+def _corner_mask(size):
+  if size not in _CORNER_MASKS:
+    cx, cy = size[0] / 2.0, size[1] / 2.0
+    r = max(size[0] / 2.0, size[1] / 2.0)
+    x, y = np.ogrid[:size[0], :size[1]]
+    x_sqrt = (x + 0.5 - cx) ** 2
+    y_sqrt = (y + 0.5 - cy) ** 2
+    _CORNER_MASKS[size] = x_sqrt + y_sqrt > (r - 0.5) ** 2
+  return _CORNER_MASKS[size]
+
+
+def _window(grid, bottomleft, size):
+  window = np.zeros(size, dtype=grid.dtype)
+  x0, y0 = bottomleft[0] + GRID_PADDING, bottomleft[1] + GRID_PADDING
+  gx0, gy0 = max(x0, 0), max(y0, 0)
+  gx1 = min(x0 + size[0], GRID_SIZE)
+  gy1 = min(y0 + size[1], GRID_SIZE)
+  if gx1 > gx0 and gy1 > gy0:
+    window[gx0 - x0:gx1 - x0, gy0 - y0:gy1 - y0] = grid[gx0:gx1, gy0:gy1]
+  return window
+
+
+def _dilate(occupied, margin):
+  if margin <= 0: return occupied
+  # box sum over [c - margin, c + margin] along both axes via prefix sums
+  counts = np.pad(occupied.astype(np.int32), margin + 1, mode='constant')
+  counts = counts.cumsum(axis=0).cumsum(axis=1)
+  w = 2 * margin + 1
+  box = counts[w:, w:] - counts[:-w, w:] - counts[w:, :-w] + counts[:-w, :-w]
+  return box[:GRID_SIZE, :GRID_SIZE] > 0
+
+
+def _static_obstacles():
+  grid = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.int32)
+  r = 2.5
+  _stamp_rects(grid, [(int(math.floor(x - r)), int(math.floor(x + r)),
+                       int(math.floor(y - r)), int(math.floor(y + r)))
+                      for x, y in SLOPES + HOLES], 1)
+  return grid > 0
+
+
+class OccupancyGrid(object):
+
+  def __init__(self, expand_mineral=False, shrink_mineral=False):
+    self._expand_mineral = expand_mineral
+    self._shrink_mineral = shrink_mineral
+    self._counts = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.int32)
+    self._footprints = {}
+    self._dilated = {}
+
+  def update(self, unit_table):
+    footprints = self._unit_footprints(unit_table)
+    removed = [(tag, rect) for tag, rect in self._footprints.items()
+               if footprints.get(tag) != rect]
+    added = [(tag, rect) for tag, rect in footprints.items()
+             if self._footprints.get(tag) != rect]
+    if len(removed) > 0 or len(added) > 0:
+      _stamp_rects(self._counts, [rect for _, rect in removed + added],
+                   [-1] * len(removed) + [1] * len(added))
+      self._dilated.clear()
+    self._footprints = footprints
+
+  def window(self, bottomleft, size, margin):
+    x0, y0 = bottomleft[0] + GRID_PADDING, bottomleft[1] + GRID_PADDING
+    if (x0 - margin >= 0 and y0 - margin >= 0 and
+        x0 + size[0] + margin <= GRID_SIZE and
+        y0 + size[1] + margin <= GRID_SIZE):
+      if margin not in self._dilated:
+        self._dilated[margin] = _dilate(self._counts > 0, margin)
+      return _window(self._dilated[margin], bottomleft, size)
+    # windows reaching off the map grid are stamped directly
+    window = np.zeros(size, dtype=np.int32)
+    rects = np.array(list(self._footprints.values()),
+                     dtype=np.int64).reshape(-1, 4)
+    _stamp_rects(window, rects + [-margin, margin, -margin, margin], 1,
+                 offset=(-bottomleft[0], -bottomleft[1]))
+    return window > 0
+
+  def _unit_footprints(self, unit_table):
+    ids = unit_table.indices(np.isin(unit_table.unit_type,
+                                     list(PLACE_COLLISION_BUILDINGS)))
+    pos_x, pos_y = unit_table.pos_x[ids], unit_table.pos_y[ids]
+    radius = unit_table.radius[ids]
+    off_x, off_y = (pos_x % 1 != 0) * 0.5, (pos_y % 1 != 0) * 0.5
+    small = radius <= 1.0
+    r_x = np.where(small, 1.0 - off_x, np.trunc(radius) + off_x)
+    r_y = np.where(small, 1.0 - off_y, np.trunc(radius) + off_y)
+    is_mineral = np.isin(unit_table.unit_type[ids], list(MINERAL_TYPES))
+    if self._shrink_mineral:
+      shrink_x = is_mineral & (r_x == 1.5) & (r_y == 1)
+      shrink_y = is_mineral & ~shrink_x & (r_x == 1) & (r_y == 1.5)
+      r_x = np.where(shrink_x, 0.5, r_x)
+      r_y = np.where(shrink_y, 0.5, r_y)
+    if self._expand_mineral:
+      r_x = r_x + is_mineral
+      r_y = r_y + is_mineral
+    rects = zip(np.floor(pos_x - r_x).astype(np.int64).tolist(),
+                np.floor(pos_x + r_x).astype(np.int64).tolist(),
+                np.floor(pos_y - r_y).astype(np.int64).tolist(),
+                np.floor(pos_y + r_y).astype(np.int64).tolist())
+    return dict(zip(unit_table.tag[ids].tolist(), rects))
+
+
+class ExpansionTable(object):
+
+  def __init__(self, mineral_positions, mineral_expansions, anchors, places):
+    self.mineral_positions = mineral_positions
+    self.mineral_expansions = mineral_expansions
+    self.anchors = anchors
+    self.places = places
+    self._mineral_ids = dict((tuple(p), i)
+                             for i, p in enumerate(mineral_positions.tolist()))
+
+  def first_unexploited(self, unexploited_minerals):
+    ids = [self._mineral_ids.get((u.float_attr.pos_x, u.float_attr.pos_y))
+           for u in unexploited_minerals]
+    # a mineral unknown to the table could be closer than every anchor
+    if len(ids) == 0 or None in ids: return None
+    is_unexploited = np.zeros(len(self.mineral_positions), dtype=bool)
+    is_unexploited[ids] = True
+    expansion = int(self.mineral_expansions[is_unexploited].min())
+    # only an unexploited anchor is the closest mineral a fresh search takes
+    if not is_unexploited[self.anchors[expansion]]: return None
+    return expansion
+
+  def anchor_position(self, expansion):
+    return tuple(self.mineral_positions[self.anchors[expansion]].tolist())
+
+  def place(self, expansion):
+    place = self.places[expansion]
+    return None if np.isnan(place[0]) else tuple(place.tolist())
+
+  def save(self, path):
+    # concurrent actors may write the same table, so each uses its own file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                    suffix='.tmp.npz')
+    with os.fdopen(fd, 'wb') as f:
+      np.savez(f, mineral_positions=self.mineral_positions,
+               mineral_expansions=self.mineral_expansions,
+               anchors=self.anchors,
+               places=self.places)
+    os.replace(tmp_path, path)
+
+  @staticmethod
+  def load(path):
+    data = np.load(path)
+    return ExpansionTable(data['mineral_positions'],
+                          data['mineral_expansions'], data['anchors'],
+                          data['places'])
+
+
+def _resource_positions(units):
+  return np.array([(u.float_attr.pos_x, u.float_attr.pos_y) for u in units],
+                  dtype=np.float64).reshape(-1, 2)
+
+
 class Placer(object):
 
+  def __init__(self, map_name=None, cache_dir=None):
+    self._static_obstacles = _static_obstacles()
+    self._occupancy = {}
+    self._map_name = map_name
+    self._cache_dir = cache_dir
+    self._expansions = None
+    self._replaced_places = {}
+
+  def reset(self):
+    self._expansions = None
+    self._replaced_places = {}
+
   def get_building_position(self, type_id, dc):
     if type_id == UNIT_TYPE.ZERG_HATCHERY.value:
       return self._next_base_place(dc)
@@ -34,6 +237,10 @@ class Placer(object):
       return len(place) > 0
 
   def _constructable_place(self, margin, dc):
+    return dc.cached(('constructable_place', margin),
+                     lambda: self._search_constructable_place(margin, dc))
+
+  def _search_constructable_place(self, margin, dc):
     place = []
     bases = dc.mature_units_of_types([UNIT_TYPE.ZERG_HATCHERY.value,
                                       UNIT_TYPE.ZERG_LAIR.value,
@@ -48,10 +255,70 @@ class Placer(object):
     return place
 
   def _next_base_place(self, dc):
+    return dc.cached('next_base_place',
+                     lambda: self._search_next_base_place(dc))
+
+  def _search_next_base_place(self, dc):
     unexploited_minerals = dc.unexploited_minerals
     if len(unexploited_minerals) == 0: return None
-    mineral_to_exploit = utils.closest_unit(dc.init_base_pos,
-                                            unexploited_minerals)
+    if self._expansions is None:
+      self._expansions = self._expansion_table(dc)
+    expansion = self._expansions.first_unexploited(unexploited_minerals)
+    if expansion is None:
+      mineral_to_exploit = utils.closest_unit(dc.init_base_pos,
+                                              unexploited_minerals)
+      return self._search_base_place_near(mineral_to_exploit, dc)
+    # only the footprint of the stored place is checked on each step
+    place = self._replaced_places.get(expansion,
+                                      self._expansions.place(expansion))
+    if place is None or not self._is_base_place_free(place, dc):
+      place = self._search_base_place_near(
+          self._expansions.anchor_position(expansion), dc)
+      self._replaced_places[expansion] = place
+    return place
+
+  def _is_base_place_free(self, place, dc):
+    bottomleft = (int(math.floor(place[0])), int(math.floor(place[1])))
+    return not self._occupied(dc, bottomleft, (1, 1), 5.5, False, True)[0, 0]
+
+  def _expansion_table(self, dc):
+    key = (self._map_name, dc.init_base_pos)
+    if self._map_name is not None and key in _EXPANSION_TABLES:
+      return _EXPANSION_TABLES[key]
+    path = None
+    if self._map_name is not None and self._cache_dir is not None:
+      path = os.path.join(self._cache_dir, '%s_%d_%d.npz' % (
+          self._map_name, dc.init_base_pos[0], dc.init_base_pos[1]))
+    if path is not None and os.path.exists(path):
+      table = ExpansionTable.load(path)
+    else:
+      table = self._analyze_expansions(dc)
+      if path is not None:
+        os.makedirs(self._cache_dir, exist_ok=True)
+        table.save(path)
+    if self._map_name is not None: _EXPANSION_TABLES[key] = table
+    return table
+
+  def _analyze_expansions(self, dc):
+    minerals = dc.minerals
+    mineral_positions = _resource_positions(minerals)
+    dist = np.hypot(mineral_positions[:, 0] - dc.init_base_pos[0],
+                    mineral_positions[:, 1] - dc.init_base_pos[1])
+    mineral_expansions = np.full(len(minerals), -1, dtype=np.int64)
+    anchors, places = [], []
+    for i in np.argsort(dist, kind='stable'):
+      if mineral_expansions[i] >= 0: continue
+      near = np.hypot(mineral_positions[:, 0] - mineral_positions[i, 0],
+                      mineral_positions[:, 1] - mineral_positions[i, 1]) <= 14
+      mineral_expansions[near & (mineral_expansions < 0)] = len(places)
+      anchors.append(i)
+      place = self._search_base_place_near(minerals[i], dc)
+      places.append(place if place is not None else (np.nan, np.nan))
+    places = np.array(places, dtype=np.float64).reshape(-1, 2)
+    return ExpansionTable(mineral_positions, mineral_expansions,
+                          np.array(anchors, dtype=np.int64), places)
+
+  def _search_base_place_near(self, mineral_to_exploit, dc):
     resources_nearby = utils.units_nearby(mineral_to_exploit,
                                           dc.minerals + dc.gas,
                                           max_distance=14)
@@ -85,73 +352,24 @@ class Placer(object):
     return utils.closest_unit((x_mean, y_mean), place) \
         if len(place) > 0 else None
 
+  def _occupied(self, dc, bottomleft, size, margin, expand_mineral,
+                shrink_mineral):
+    mode = (expand_mineral, shrink_mineral)
+    if mode not in self._occupancy:
+      self._occupancy[mode] = OccupancyGrid(expand_mineral, shrink_mineral)
+    grid = self._occupancy[mode]
+    dc.cached(('occupancy', id(self), mode),
+              lambda: grid.update(dc.unit_table))
+    return grid.window(bottomleft, size, int(math.floor(margin))) | \
+        _window(self._static_obstacles, bottomleft, size)
+
   def _search_place(self, search_region, dc, margin=0, remove_corner=False,
                     expand_mineral=False, shrink_mineral=False):
     bottomleft = tuple(map(int, search_region[:2]))
     size = tuple(map(int, search_region[2:]))
-    grids = np.zeros(size).astype(np.int)
+    grids = self._occupied(dc, bottomleft, size, margin, expand_mineral,
+                           shrink_mineral)
     if remove_corner:
-      cx, cy = size[0] / 2.0, size[1] / 2.0
-      r = max(size[0] / 2.0, size[1] / 2.0)
-      r_sqrt = (r - 0.5) ** 2
-      for x in range(size[0]):
-        x_sqrt = (x + 0.5 - cx) ** 2
-        for y in range(size[1]):
-          y_sqrt = (y + 0.5 - cy) ** 2
-          if x_sqrt + y_sqrt > r_sqrt:
-            grids[x, y] = 1
-    filter_range = (bottomleft[0] - 10, bottomleft[0] + size[0] + 10,
-                    bottomleft[1] - 10, bottomleft[1] + size[1] + 10)
-    sitted_units = [u for u in dc.units
-                    if (u.unit_type in PLACE_COLLISION_BUILDINGS and
-                        u.float_attr.pos_x >= filter_range[0] and
-                        u.float_attr.pos_x <= filter_range[1] and
-                        u.float_attr.pos_y >= filter_range[2] and
-                        u.float_attr.pos_y <= filter_range[3])]
-    sitted_units = [u for u in dc.units
-                    if u.unit_type in PLACE_COLLISION_BUILDINGS]
-    margin_int = math.floor(margin)
-    for u in sitted_units:
-      if u.float_attr.radius <= 1.0:
-        r_x = r_y = 1.0
-        if u.float_attr.pos_x % 1 != 0: r_x -= 0.5
-        if u.float_attr.pos_y % 1 != 0: r_y -= 0.5
-      else:
-        r_x = r_y = float(int(u.float_attr.radius))
-        if u.float_attr.pos_x % 1 != 0: r_x += 0.5
-        if u.float_attr.pos_y % 1 != 0: r_y += 0.5
-      if (shrink_mineral and
-          u.unit_type in {UNIT_TYPE.NEUTRAL_MINERALFIELD.value,
-          UNIT_TYPE.NEUTRAL_MINERALFIELD750.value}):
-        if r_x == 1.5 and r_y == 1: r_x = 0.5
-        elif r_x == 1 and r_y == 1.5: r_y = 0.5
-      if (expand_mineral and
-          u.unit_type in {UNIT_TYPE.NEUTRAL_MINERALFIELD.value,
-                          UNIT_TYPE.NEUTRAL_MINERALFIELD750.value}):
-        r_x += 1
-        r_y += 1
-      r_x += margin_int
-      r_y += margin_int
-      xl = int(u.float_attr.pos_x - r_x - bottomleft[0])
-      xr = int(u.float_attr.pos_x + r_x - bottomleft[0])
-      yu = int(u.float_attr.pos_y - r_y - bottomleft[1])
-      yd = int(u.float_attr.pos_y + r_y - bottomleft[1])
-      grids[max(xl, 0) : max(min(xr, size[0]), 0),
-            max(yu, 0) : max(min(yd, size[1]), 0)] = 1
-
-    slopes = [(76.5, 90.5), (73.5, 86.5), (123.5, 52.5), (126.5, 56.5),
-              (131.5, 36.5), (68.5, 106.5)]
-    holes = [(124.5, 34.5), (76.5, 108.5), (154.5, 60.5), (45.5, 82.5)]
-    r = 2.5
-    for x, y in slopes + holes:
-      xl = int(x - r  - bottomleft[0])
-      xr = int(x + r - bottomleft[0])
-      yu = int(y - r - bottomleft[1])
-      yd = int(y + r - bottomleft[1])
-      grids[max(xl, 0) : max(min(xr, size[0]), 0),
-            max(yu, 0) : max(min(yd, size[1]), 0)] = 1
-    x, y = np.nonzero(1 - grids)
-    #if remove_corner == True:
-      #np.set_printoptions(threshold=np.nan, linewidth=300)
-      #print(grids)
+      grids = grids | _corner_mask(size)
+    x, y = np.nonzero(~grids)
     return list(zip(x + bottomleft[0] + 0.5, y + bottomleft[1] + 0.5))
@@ -5,58 +5,59 @@ from __future__ import print_function
 import random
 
 from s2clientprotocol import sc2api_pb2 as sc_pb
-from pysc2.lib.tech_tree import TechTree
 
 from sc2learner.envs.actions.function import Function
+from sc2learner.envs.actions.mask_engine import Requirement
+from sc2learner.envs.actions.mask_engine import is_satisfied
+from sc2learner.envs.common.tech_data import unit_data
 from sc2learner.envs.common.const import MAXIMUM_NUM
 
 
 class ProduceActions(object):
 
   def __init__(self, game_version='4.1.2'):
-    self._tech_tree = TechTree()
-    self._tech_tree.update_version(game_version)
+    self._game_version = game_version
 
   def action(self, func_name, type_id):
+    requirement = self._requirement(type_id)
     return Function(name=func_name,
                     function=self._produce_unit(type_id),
-                    is_valid=self._is_valid_produce_unit(type_id))
+                    is_valid=self._is_valid_produce_unit(requirement),
+                    requirement=requirement)
+
+  def _requirement(self, type_id):
+    tech = unit_data(type_id, self._game_version)
+    return Requirement(
+        required_units=tech.required_units,
+        required_upgrades=tech.required_upgrades,
+        mineral_cost=tech.mineral_cost,
+        gas_cost=tech.gas_cost,
+        supply_cost=tech.supply_cost,
+        builders=tech.builders,
+        idle_builders=True,
+        build_ability=tech.build_ability,
+        no_pending_task=False,
+        quota=(type_id, MAXIMUM_NUM[type_id]) if type_id in MAXIMUM_NUM \
+            else None,
+        upgrade_id=None,
+        predicate=None)
 
   def _produce_unit(self, type_id):
+    tech = unit_data(type_id, self._game_version)
 
     def act(dc):
-      tech = self._tech_tree.getUnitData(type_id)
-      if len(dc.idle_units_of_types(tech.whatBuilds)) == 0: return []
-      producer = random.choice(dc.idle_units_of_types(tech.whatBuilds))
+      if len(dc.idle_units_of_types(tech.builders)) == 0: return []
+      producer = random.choice(dc.idle_units_of_types(tech.builders))
       action = sc_pb.Action()
       action.action_raw.unit_command.unit_tags.append(producer.tag)
-      action.action_raw.unit_command.ability_id = tech.buildAbility
+      action.action_raw.unit_command.ability_id = tech.build_ability
       return [action]
 
     return act
 
-  def _is_valid_produce_unit(self, type_id):
+  def _is_valid_produce_unit(self, requirement):
 
     def is_valid(dc):
-      tech = self._tech_tree.getUnitData(type_id)
-      has_required_units = any([len(dc.mature_units_of_type(u)) > 0
-                                for u in tech.requiredUnits]) \
-          if len(tech.requiredUnits) > 0 else True
-      has_required_upgrades = all([t in dc.upgraded_techs
-                                   for t in tech.requiredUpgrades])
-      current_num = len(dc.units_of_type(type_id)) + \
-          len(dc.units_with_task(tech.buildAbility))
-      overquota = current_num >= MAXIMUM_NUM[type_id] \
-          if type_id in MAXIMUM_NUM else False
-      if (has_required_units and
-          has_required_upgrades and
-          not overquota and
-          dc.mineral_count >= tech.mineralCost and
-          dc.gas_count >= tech.gasCost and
-          dc.supply_count >= tech.supplyCost and
-          len(dc.idle_units_of_types(tech.whatBuilds)) > 0):
-        return True
-      else:
-        return False
+      return is_satisfied(requirement, dc)
 
     return is_valid
@@ -4,11 +4,13 @@ from __future__ import print_function
 
 import random
 
+import numpy as np
 from s2clientprotocol import sc2api_pb2 as sc_pb
 from pysc2.lib.typeenums import UNIT_TYPEID as UNIT_TYPE
 from pysc2.lib.typeenums import ABILITY_ID as ABILITY
 
 from sc2learner.envs.actions.function import Function
+from sc2learner.envs.common.spatial_index import GridIndex
 import sc2learner.envs.common.utils as utils
 
 
@@ -71,44 +73,38 @@ class ResourceActions(object):
     else: return False
 
   def _all_idle_workers_gather_minerals(self, dc):
-    idle_workers = dc.idle_units_of_type(UNIT_TYPE.ZERG_DRONE.value)
+    assignment = self._worker_assignment(dc)
+    idle_workers = dc.idle_indices_of_type(UNIT_TYPE.ZERG_DRONE.value)
+    minerals = assignment.closest_minerals(idle_workers)
+    table = dc.unit_table
     actions = []
-    for worker in idle_workers:
-      mineral = utils.closest_unit(worker, dc.minerals)
+    for worker, mineral in zip(idle_workers, minerals):
+      if mineral is None: continue
       action = sc_pb.Action()
-      action.action_raw.unit_command.unit_tags.append(worker.tag)
+      action.action_raw.unit_command.unit_tags.append(table.unit(worker).tag)
       action.action_raw.unit_command.ability_id = \
           ABILITY.HARVEST_GATHER_DRONE.value
-      action.action_raw.unit_command.target_unit_tag = mineral.tag
+      action.action_raw.unit_command.target_unit_tag = table.unit(mineral).tag
       actions.append(action)
     return actions
 
   def _is_valid_all_idle_workers_gather_minerals(self, dc):
-    if (len(dc.idle_units_of_type(UNIT_TYPE.ZERG_DRONE.value)) > 0 and
-        len(dc.minerals) > 0):
+    if (dc.num_idle_units_of_type(UNIT_TYPE.ZERG_DRONE.value) > 0 and
+        len(dc.mineral_indices) > 0):
       return True
     else:
       return False
 
   def _assign_workers_gather_gas(self, dc):
-    idle_extractors =  [
-        u for u in dc.units_of_type(UNIT_TYPE.ZERG_EXTRACTOR.value)
-        if u.int_attr.ideal_harvesters - u.int_attr.assigned_harvesters > 0
-    ]
+    assignment = self._worker_assignment(dc)
+    idle_extractors = assignment.idle_extractors
     if len(idle_extractors) == 0: return []
     extractor = random.choice(idle_extractors)
     num_workers_need = extractor.int_attr.ideal_harvesters - \
         extractor.int_attr.assigned_harvesters
-    extractor_tags = set(u.tag for u in dc.units_of_type(
-        UNIT_TYPE.ZERG_EXTRACTOR.value))
-    workers = [
-        u for u in dc.units_of_type(UNIT_TYPE.ZERG_DRONE.value)
-        if (len(u.orders) == 0 or
-            (u.orders[0].ability_id == ABILITY.HARVEST_GATHER_DRONE.value and
-             u.orders[0].target_tag not in extractor_tags))
-    ]
-    if len(workers) == 0: return []
-    assigned_workers = utils.closest_units(extractor, workers, num_workers_need)
+    if len(assignment.gas_workers) == 0: return []
+    assigned_workers = assignment.closest_gas_workers(extractor,
+                                                      num_workers_need)
     action = sc_pb.Action()
     action.action_raw.unit_command.unit_tags.extend(
         [u.tag for u in assigned_workers])
@@ -118,48 +114,73 @@ class ResourceActions(object):
     return [action]
 
   def _is_valid_assign_workers_gather_gas(self, dc):
-    idle_extractors =  [
-        u for u in dc.units_of_type(UNIT_TYPE.ZERG_EXTRACTOR.value)
-        if u.int_attr.ideal_harvesters - u.int_attr.assigned_harvesters > 0
-    ]
-    extractor_tags = set(u.tag for u in dc.units_of_type(
-        UNIT_TYPE.ZERG_EXTRACTOR.value))
-    workers = [
-        u for u in dc.units_of_type(UNIT_TYPE.ZERG_DRONE.value)
-        if (len(u.orders) == 0 or
-            (u.orders[0].ability_id == ABILITY.HARVEST_GATHER_DRONE.value and
-             u.orders[0].target_tag not in extractor_tags))
-    ]
-    if len(idle_extractors) > 0 and len(workers) > 0: return True
-    else: return False
+    assignment = self._worker_assignment(dc)
+    if (len(assignment.idle_extractors) > 0 and
+        len(assignment.gas_workers) > 0):
+      return True
+    else:
+      return False
 
   def _assign_workers_gather_minerals(self, dc):
-    extractor_tags = set(u.tag for u in dc.units_of_type(
-        UNIT_TYPE.ZERG_EXTRACTOR.value))
-    workers = [
-        u for u in dc.units_of_type(UNIT_TYPE.ZERG_DRONE.value)
-        if (len(u.orders) == 0 or
-            (u.orders[0].ability_id == ABILITY.HARVEST_GATHER_DRONE.value and
-             u.orders[0].target_tag in extractor_tags))
-    ]
+    assignment = self._worker_assignment(dc)
+    workers = assignment.mineral_workers.tolist()
+    workers = random.sample(workers, min(3, len(workers)))
+    minerals = assignment.closest_minerals(workers)
+    table = dc.unit_table
     actions = []
-    for worker in random.sample(workers, min(3, len(workers))):
-      target_mineral = utils.closest_unit(worker, dc.minerals)
+    for worker, mineral in zip(workers, minerals):
+      if mineral is None: continue
       action = sc_pb.Action()
-      action.action_raw.unit_command.unit_tags.append(worker.tag)
+      action.action_raw.unit_command.unit_tags.append(table.unit(worker).tag)
       action.action_raw.unit_command.ability_id = \
           ABILITY.HARVEST_GATHER_DRONE.value
-      action.action_raw.unit_command.target_unit_tag = target_mineral.tag
+      action.action_raw.unit_command.target_unit_tag = table.unit(mineral).tag
       actions.append(action)
     return actions
 
   def _is_valid_assign_workers_gather_minerals(self, dc):
-    extractor_tags = set(u.tag for u in dc.units_of_type(
-        UNIT_TYPE.ZERG_EXTRACTOR.value))
-    workers = [
-        u for u in dc.units_of_type(UNIT_TYPE.ZERG_DRONE.value)
-        if (len(u.orders) == 0 or
-            (u.orders[0].ability_id == ABILITY.HARVEST_GATHER_DRONE.value and
-             u.orders[0].target_tag in extractor_tags))
+    return len(self._worker_assignment(dc).mineral_workers) > 0
+
+  def _worker_assignment(self, dc):
+    return dc.cached('worker_assignment', lambda: WorkerAssignment(dc))
+
+
+class WorkerAssignment(object):
+
+  def __init__(self, dc):
+    table = dc.unit_table
+    self._table = table
+    extractor_ids = np.array(dc.indices_of_type(UNIT_TYPE.ZERG_EXTRACTOR.value),
+                             dtype=np.int64)
+    self.idle_extractors = [
+        u for u in table.units_at(extractor_ids)
+        if u.int_attr.ideal_harvesters - u.int_attr.assigned_harvesters > 0
     ]
-    return len(workers) > 0
+    drones = np.array(dc.indices_of_type(UNIT_TYPE.ZERG_DRONE.value),
+                      dtype=np.int64)
+    no_orders = table.num_orders[drones] == 0
+    gathering = table.order_ability_id[drones] == \
+        ABILITY.HARVEST_GATHER_DRONE.value
+    on_gas = np.isin(table.order_target_tag[drones],
+                     table.tag[extractor_ids])
+    self.gas_workers = drones[no_orders | (gathering & ~on_gas)]
+    self.mineral_workers = drones[no_orders | (gathering & on_gas)]
+    self._minerals = np.array(dc.mineral_indices, dtype=np.int64)
+    self._mineral_index = None
+
+  def closest_minerals(self, workers):
+    if len(workers) == 0: return []
+    # workers get no target once every mineral field is mined out
+    if len(self._minerals) == 0: return [None] * len(workers)
+    if self._mineral_index is None:
+      self._mineral_index = GridIndex(self._table.positions[self._minerals])
+    ids, _ = self._mineral_index.nearest(
+        self._table.positions[np.asarray(workers, dtype=np.int64)])
+    return self._minerals[ids].tolist()
+
+  def closest_gas_workers(self, extractor, num):
+    diff = self._table.positions[self.gas_workers] - \
+        (extractor.float_attr.pos_x, extractor.float_attr.pos_y)
+    dist = np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1])
+    order = np.argsort(dist, kind='stable')[:num]
+    return self._table.units_at(self.gas_workers[order])
@@ -5,54 +5,57 @@ from __future__ import print_function
 import random
 
 from s2clientprotocol import sc2api_pb2 as sc_pb
-from pysc2.lib.tech_tree import TechTree
 
 from sc2learner.envs.actions.function import Function
+from sc2learner.envs.actions.mask_engine import Requirement
+from sc2learner.envs.actions.mask_engine import is_satisfied
+from sc2learner.envs.common.tech_data import upgrade_data
 
 
 class UpgradeActions(object):
 
   def __init__(self, game_version='4.1.2'):
-    self._tech_tree = TechTree()
-    self._tech_tree.update_version(game_version)
+    self._game_version = game_version
 
   def action(self, func_name, upgrade_id):
+    requirement = self._requirement(upgrade_id)
     return Function(name=func_name,
                     function=self._upgrade_unit(upgrade_id),
-                    is_valid=self._is_valid_upgrade_unit(upgrade_id))
+                    is_valid=self._is_valid_upgrade_unit(requirement),
+                    requirement=requirement)
+
+  def _requirement(self, upgrade_id):
+    tech = upgrade_data(upgrade_id, self._game_version)
+    return Requirement(
+        required_units=tech.required_units,
+        required_upgrades=tech.required_upgrades,
+        mineral_cost=tech.mineral_cost,
+        gas_cost=tech.gas_cost,
+        supply_cost=tech.supply_cost,
+        builders=tech.builders,
+        idle_builders=True,
+        build_ability=tech.build_ability,
+        no_pending_task=True,
+        quota=None,
+        upgrade_id=upgrade_id,
+        predicate=None)
 
   def _upgrade_unit(self, upgrade_id):
+    tech = upgrade_data(upgrade_id, self._game_version)
 
     def act(dc):
-      tech = self._tech_tree.getUpgradeData(upgrade_id)
-      if len(dc.idle_units_of_types(tech.whatBuilds)) == 0: return []
-      upgrader = random.choice(dc.idle_units_of_types(tech.whatBuilds))
+      if len(dc.idle_units_of_types(tech.builders)) == 0: return []
+      upgrader = random.choice(dc.idle_units_of_types(tech.builders))
       action = sc_pb.Action()
       action.action_raw.unit_command.unit_tags.append(upgrader.tag)
-      action.action_raw.unit_command.ability_id = tech.buildAbility
+      action.action_raw.unit_command.ability_id = tech.build_ability
       return [action]
 
     return act
 
-  def _is_valid_upgrade_unit(self, upgrade_id):
+  def _is_valid_upgrade_unit(self, requirement):
 
     def is_valid(dc):
-      tech = self._tech_tree.getUpgradeData(upgrade_id)
-      has_required_units = any([len(dc.mature_units_of_type(u)) > 0
-                                for u in tech.requiredUnits]) \
-          if len(tech.requiredUnits) > 0 else True
-      has_required_upgrades = all([t in dc.upgraded_techs
-                                   for t in tech.requiredUpgrades])
-      if (has_required_units and
-          has_required_upgrades and
-          upgrade_id not in dc.upgraded_techs and
-          len(dc.units_with_task(tech.buildAbility)) == 0 and
-          dc.mineral_count >= tech.mineralCost and
-          dc.gas_count >= tech.gasCost and
-          dc.supply_count >= tech.supplyCost and
-          len(dc.idle_units_of_types(tech.whatBuilds)) > 0):
-        return True
-      else:
-        return False
+      return is_satisfied(requirement, dc)
 
     return is_valid
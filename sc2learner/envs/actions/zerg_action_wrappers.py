@@ -16,6 +16,8 @@ from sc2learner.envs.spaces.pysc2_raw import PySC2RawObservation
 from sc2learner.envs.spaces.mask_discrete import MaskDiscrete
 from sc2learner.envs.common.data_context import DataContext
 from sc2learner.envs.actions.function import Function
+from sc2learner.envs.actions.mask_engine import ActionMaskEngine
+from sc2learner.envs.actions.command_grouping import group_unit_commands
 from sc2learner.envs.actions.produce import ProduceActions
 from sc2learner.envs.actions.build import BuildActions
 from sc2learner.envs.actions.upgrade import UpgradeActions
@@ -26,13 +28,18 @@ from sc2learner.envs.actions.combat import CombatActions
 class ZergActionWrapper(gym.Wrapper):
 
   def __init__(self, env, game_version='4.1.2', mask=False,
-               use_all_combat_actions=False):
+               use_all_combat_actions=False, group_commands=True,
+               map_name=None, expansion_cache_dir=None):
     super(ZergActionWrapper, self).__init__(env)
     # TODO: multiple observation space
     #assert isinstance(env.observation_space, PySC2RawObservation)
 
     self._dc = DataContext()
-    self._build_mgr = BuildActions(game_version)
+    self._group_commands = group_commands
+    self._num_coalesced_actions = 0
+    if map_name is None:
+      map_name = getattr(env.unwrapped, 'map_name', None)
+    self._build_mgr = BuildActions(game_version, map_name, expansion_cache_dir)
     self._produce_mgr = ProduceActions(game_version)
     self._upgrade_mgr = UpgradeActions(game_version)
     self._resource_mgr = ResourceActions()
@@ -126,6 +133,8 @@ class ZergActionWrapper(gym.Wrapper):
         self._combat_mgr.action_framewise_rally_and_attack
     ]
 
+    self._mask_engine = ActionMaskEngine(self._actions)
+
     if mask: self.action_space = MaskDiscrete(len(self._actions))
     else: self.action_space = Discrete(len(self._actions))
 
@@ -133,16 +142,20 @@ class ZergActionWrapper(gym.Wrapper):
     actions = self._actions[action].function(self._dc)
     pre_actions, post_actions = self._required_actions()
     observation, reward, done, info = self.env.step(
-        pre_actions + actions + post_actions)
+        self._group(pre_actions + actions + post_actions))
     self._dc.update(observation)
+    observation['data_context'] = self._dc
     if isinstance(self.action_space, MaskDiscrete):
       observation['action_mask'] = self._get_valid_action_mask()
     return observation, reward, done, info
 
   def reset(self, **kwargs):
     self._combat_mgr.reset()
+    self._build_mgr.reset()
+    self._num_coalesced_actions = 0
     observation = self.env.reset()
     self._dc.reset(observation)
+    observation['data_context'] = self._dc
     if isinstance(self.action_space, MaskDiscrete):
       observation['action_mask'] = self._get_valid_action_mask()
     return observation
@@ -156,6 +169,16 @@ class ZergActionWrapper(gym.Wrapper):
     if self._dc.init_base_pos[0] < 100: return 0
     else: return 1
 
+  @property
+  def num_coalesced_actions(self):
+    return self._num_coalesced_actions
+
+  def _group(self, actions):
+    if not self._group_commands: return actions
+    actions, num_coalesced = group_unit_commands(actions)
+    self._num_coalesced_actions += num_coalesced
+    return actions
+
   def _required_actions(self):
     pre_actions = []
     for fn in self._required_pre_actions:
@@ -170,11 +193,7 @@ class ZergActionWrapper(gym.Wrapper):
     return pre_actions, post_actions
 
   def _get_valid_action_mask(self):
-    ids = [i for i, action in enumerate(self._actions)
-           if action.is_valid(self._dc)]
-    mask = np.zeros(self.action_space.n)
-    mask[ids] = 1
-    return mask
+    return self._mask_engine.valid_mask(self._dc)
 
   def _action_do_nothing(self):
     return Function(name='do_nothing',
@@ -192,17 +211,21 @@ class ZergPlayerActionWrapper(ZergActionWrapper):
   def step(self, action):
     actions = self._actions[action[self._player]].function(self._dc)
     pre_actions, post_actions = self._required_actions()
-    action[self._player] = pre_actions + actions + post_actions
+    action[self._player] = self._group(pre_actions + actions + post_actions)
     observation, reward, done, info = self.env.step(action)
     self._dc.update(observation[self._player])
+    observation[self._player]['data_context'] = self._dc
     if isinstance(self.action_space, MaskDiscrete):
       observation[self._player]['action_mask'] = self._get_valid_action_mask()
     return observation, reward, done, info
 
   def reset(self, **kwargs):
     self._combat_mgr.reset()
+    self._build_mgr.reset()
+    self._num_coalesced_actions = 0
     observation = self.env.reset()
     self._dc.reset(observation[self._player])
+    observation[self._player]['data_context'] = self._dc
     if isinstance(self.action_space, MaskDiscrete):
       observation[self._player]['action_mask'] = self._get_valid_action_mask()
     return observation
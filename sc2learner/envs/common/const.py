@@ -165,3 +165,6 @@ class MAP(object):
   RIGHT = 24.0
   TOP = 37.0
   BOTTOM = 4.0
+
+
+RAW_ONLY_RESOLUTION = 1
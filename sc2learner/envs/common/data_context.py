@@ -4,28 +4,41 @@ from __future__ import print_function
 
 import itertools
 
+import numpy as np
 from pysc2.lib.typeenums import UNIT_TYPEID as UNIT_TYPE
 
 from sc2learner.envs.common.const import ALLY_TYPE
 from sc2learner.envs.common.const import PLAYER_FEATURE
 from sc2learner.envs.common.const import COMBAT_TYPES
-import sc2learner.envs.common.utils as utils
+from sc2learner.envs.common.unit_table import UnitTable
+from sc2learner.envs.common.spatial_index import GridIndex
+
+
+def _frozen(index):
+  return dict((key, tuple(indices)) for key, indices in index.items())
 
 
 class DataContext(object):
 
   def __init__(self):
     self._units = []
+    self._unit_table = UnitTable([])
     self._player = None
     self._raw_data = None
     self._existed_tags = set()
+    self._cache = {}
+    self._cache_hits, self._cache_misses = 0, 0
+    self._build_indexes()
 
   def update(self, observation):
     for u in self._units:
       self._existed_tags.add(u.tag)
     self._units = observation['units']
+    self._unit_table = UnitTable(self._units)
     self._player = observation['player']
     self._raw_data = observation['raw_data']
+    self._cache = {}
+    self._build_indexes()
     self._combat_units = self.units_of_types(COMBAT_TYPES)
 
   def reset(self, observation):
@@ -36,78 +49,196 @@ class DataContext(object):
                            init_base.float_attr.pos_y)
 
   def units_of_alliance(self, ally):
-    return [u for u in self._units if u.int_attr.alliance == ally]
+    return self._units_at(self._alliance_index.get(ally, ()))
 
   def units_of_type(self, type_id, ally=ALLY_TYPE.SELF.value):
-    return [u for u in self.units_of_alliance(ally) if u.unit_type == type_id]
+    return self._units_at(self._type_index.get((ally, type_id), ()))
 
   def mature_units_of_type(self, type_id, ally=ALLY_TYPE.SELF.value):
-    return [u for u in self.units_of_type(type_id, ally)
-            if u.float_attr.build_progress >= 1.0]
+    return self._units_at(self._mature_index.get((ally, type_id), ()))
 
   def idle_units_of_type(self, type_id, ally=ALLY_TYPE.SELF.value):
-    return [u for u in self.mature_units_of_type(type_id, ally)
-            if len(u.orders) == 0]
+    return self._units_at(self._idle_index.get((ally, type_id), ()))
 
   def units_of_types(self, type_list, ally=ALLY_TYPE.SELF.value):
-    type_set = set(type_list)
-    return [u for u in self.units_of_alliance(ally) if u.unit_type in type_set]
+    return self._units_of_types(self._type_index, type_list, ally)
 
   def mature_units_of_types(self, type_list, ally=ALLY_TYPE.SELF.value):
-    return [u for u in self.units_of_types(type_list, ally)
-            if u.float_attr.build_progress >= 1.0]
+    return self._units_of_types(self._mature_index, type_list, ally)
 
   def idle_units_of_types(self, type_list, ally=ALLY_TYPE.SELF.value):
-    return [u for u in self.mature_units_of_types(type_list, ally)
-            if len(u.orders) == 0]
+    return self._units_of_types(self._idle_index, type_list, ally)
 
   def units_with_task(self, ability_id, ally=ALLY_TYPE.SELF.value):
-    return [u for u in self.units_of_alliance(ally)
-            if ability_id in set([order.ability_id for order in u.orders])]
+    return self._units_at(self._task_index.get((ally, ability_id), ()))
+
+  def num_units_of_type(self, type_id, ally=ALLY_TYPE.SELF.value):
+    return len(self._type_index.get((ally, type_id), ()))
+
+  def num_mature_units_of_type(self, type_id, ally=ALLY_TYPE.SELF.value):
+    return len(self._mature_index.get((ally, type_id), ()))
+
+  def num_idle_units_of_type(self, type_id, ally=ALLY_TYPE.SELF.value):
+    return len(self._idle_index.get((ally, type_id), ()))
+
+  def num_units_with_task(self, ability_id, ally=ALLY_TYPE.SELF.value):
+    return len(self._task_index.get((ally, ability_id), ()))
+
+  def indices_of_type(self, type_id, ally=ALLY_TYPE.SELF.value):
+    return self._type_index.get((ally, type_id), ())
+
+  def idle_indices_of_type(self, type_id, ally=ALLY_TYPE.SELF.value):
+    return self._idle_index.get((ally, type_id), ())
+
+  def spatial_index(self, ally=None, is_flying=None):
+    return self.cached(('spatial_index', ally, is_flying),
+                       lambda: self._grid_index(np.nonzero(
+                           self._unit_mask(ally, is_flying))[0]))
+
+  def cached(self, key, fn):
+    if key in self._cache:
+      self._cache_hits += 1
+      return self._cache[key]
+    self._cache_misses += 1
+    value = fn()
+    self._cache[key] = value
+    return value
 
   def is_new_unit(self, unit):
     return unit.tag not in self._existed_tags
 
+  def _build_indexes(self):
+    table = self._unit_table
+    alliance_index, type_index, any_type_index = {}, {}, {}
+    mature_index, idle_index, task_index = {}, {}, {}
+    for i, (ally, type_id, progress, num_orders) in enumerate(zip(
+        table.alliance.tolist(), table.unit_type.tolist(),
+        table.build_progress.tolist(), table.num_orders.tolist())):
+      key = (ally, type_id)
+      alliance_index.setdefault(ally, []).append(i)
+      type_index.setdefault(key, []).append(i)
+      any_type_index.setdefault(type_id, []).append(i)
+      if progress >= 1.0:
+        mature_index.setdefault(key, []).append(i)
+        if num_orders == 0:
+          idle_index.setdefault(key, []).append(i)
+      if num_orders > 0:
+        for ability_id in set(order.ability_id
+                              for order in self._units[i].orders):
+          task_index.setdefault((ally, ability_id), []).append(i)
+    # indices are handed out to callers, so they are frozen as tuples
+    self._alliance_index = _frozen(alliance_index)
+    self._type_index = _frozen(type_index)
+    self._any_type_index = _frozen(any_type_index)
+    self._mature_index = _frozen(mature_index)
+    self._idle_index = _frozen(idle_index)
+    self._task_index = _frozen(task_index)
+
+  def _unit_mask(self, ally=None, is_flying=None):
+    table = self._unit_table
+    mask = np.ones(len(table), dtype=bool)
+    if ally is not None: mask &= table.alliance == ally
+    if is_flying is not None: mask &= table.is_flying == is_flying
+    return mask
+
+  def _grid_index(self, indices):
+    return GridIndex(self._unit_table.positions, indices)
+
+  def _units_at(self, indices):
+    units = self._units
+    return [units[i] for i in indices]
+
+  def _units_of_types(self, index, type_list, ally=None):
+    return self._units_at(self._indices_of_types(index, type_list, ally))
+
+  def _indices_of_types(self, index, type_list, ally=None):
+    keys = set(type_list) if ally is None \
+        else set((ally, type_id) for type_id in type_list)
+    index_lists = [index[key] for key in keys if key in index]
+    if len(index_lists) == 0:
+      return ()
+    elif len(index_lists) == 1:
+      return index_lists[0]
+    else:
+      return tuple(sorted(itertools.chain(*index_lists)))
+
   @property
   def units(self):
     return self._units
 
+  @property
+  def unit_table(self):
+    return self._unit_table
+
   @property
   def combat_units(self):
     return self._combat_units
 
+  @property
+  def cache_hits(self):
+    return self._cache_hits
+
+  @property
+  def cache_misses(self):
+    return self._cache_misses
+
   @property
   def minerals(self):
-    return [u for u in self._units
-            if (u.unit_type == UNIT_TYPE.NEUTRAL_MINERALFIELD.value or
-                u.unit_type == UNIT_TYPE.NEUTRAL_MINERALFIELD750.value)]
+    return self.cached('minerals',
+                       lambda: self._units_at(self._mineral_indices()))
+
+  @property
+  def mineral_indices(self):
+    return self._mineral_indices()
+
+  def _mineral_indices(self):
+    return self._indices_of_types(
+        self._any_type_index, [UNIT_TYPE.NEUTRAL_MINERALFIELD.value,
+                               UNIT_TYPE.NEUTRAL_MINERALFIELD750.value])
 
   @property
   def unexploited_minerals(self):
-    self_bases = self.units_of_types([UNIT_TYPE.ZERG_HATCHERY.value,
-                                      UNIT_TYPE.ZERG_LAIR.value,
-                                      UNIT_TYPE.ZERG_HIVE.value])
-    enemy_bases = self.units_of_types([UNIT_TYPE.ZERG_HATCHERY.value,
-                                       UNIT_TYPE.ZERG_LAIR.value,
-                                       UNIT_TYPE.ZERG_HIVE.value],
-                                      ALLY_TYPE.ENEMY.value)
-    return [u for u in self.minerals
-            if utils.closest_distance(u, self_bases + enemy_bases) > 15]
+    return self.cached('unexploited_minerals', self._unexploited_minerals)
+
+  def _unexploited_minerals(self):
+    base_types = [UNIT_TYPE.ZERG_HATCHERY.value,
+                  UNIT_TYPE.ZERG_LAIR.value,
+                  UNIT_TYPE.ZERG_HIVE.value]
+    bases = self._grid_index(
+        self._indices_of_types(self._type_index, base_types,
+                               ALLY_TYPE.SELF.value) +
+        self._indices_of_types(self._type_index, base_types,
+                               ALLY_TYPE.ENEMY.value))
+    mineral_ids = np.array(self._mineral_indices(), dtype=np.int64)
+    _, dist = bases.nearest(self._unit_table.positions[mineral_ids])
+    return self._units_at(mineral_ids[dist > 15])
 
   @property
   def gas(self):
-    return [u for u in self._units
-            if u.unit_type == UNIT_TYPE.NEUTRAL_VESPENEGEYSER.value]
+    return self.cached('gas', lambda: self._units_at(self._any_type_index.get(
+        UNIT_TYPE.NEUTRAL_VESPENEGEYSER.value, ())))
 
   @property
   def exploitable_gas(self):
-    extractors = self.units_of_type(UNIT_TYPE.ZERG_EXTRACTOR.value) + \
-        self.units_of_type(UNIT_TYPE.ZERG_EXTRACTOR.value, ALLY_TYPE.ENEMY)
-    bases = self.mature_units_of_types([UNIT_TYPE.ZERG_HATCHERY.value,
-                                        UNIT_TYPE.ZERG_LAIR.value,
-                                        UNIT_TYPE.ZERG_HIVE.value])
-    return [u for u in self.gas if (utils.closest_distance(u, bases) < 10 and
-                                    utils.closest_distance(u, extractors) > 3)]
+    return self.cached('exploitable_gas', self._exploitable_gas)
+
+  def _exploitable_gas(self):
+    extractors = self._grid_index(
+        self._type_index.get((ALLY_TYPE.SELF.value,
+                              UNIT_TYPE.ZERG_EXTRACTOR.value), ()) +
+        self._type_index.get((ALLY_TYPE.ENEMY,
+                              UNIT_TYPE.ZERG_EXTRACTOR.value), ()))
+    bases = self._grid_index(self._indices_of_types(
+        self._mature_index, [UNIT_TYPE.ZERG_HATCHERY.value,
+                             UNIT_TYPE.ZERG_LAIR.value,
+                             UNIT_TYPE.ZERG_HIVE.value],
+        ALLY_TYPE.SELF.value))
+    gas_ids = np.array(self._any_type_index.get(
+        UNIT_TYPE.NEUTRAL_VESPENEGEYSER.value, ()), dtype=np.int64)
+    gas_positions = self._unit_table.positions[gas_ids]
+    _, base_dist = bases.nearest(gas_positions)
+    _, extractor_dist = extractors.nearest(gas_positions)
+    return self._units_at(gas_ids[(base_dist < 10) & (extractor_dist > 3)])
 
   @property
   def mineral_count(self):
@@ -124,8 +255,64 @@ class DataContext(object):
 
   @property
   def upgraded_techs(self):
-    return set(self._raw_data.player.upgrade_ids)
+    return self.cached('upgraded_techs',
+                       lambda: set(self._raw_data.player.upgrade_ids))
 
   @property
   def init_base_pos(self):
     return self._init_base_pos
+
+
+if __name__ == '__main__':
+  import random
+  import time
+  from types import SimpleNamespace
+
+  def random_unit(tag):
+    return SimpleNamespace(
+        tag=tag,
+        unit_type=random.choice([u.value for u in UNIT_TYPE][:150]),
+        float_attr=SimpleNamespace(pos_x=random.uniform(0, 200),
+                                   pos_y=random.uniform(0, 176),
+                                   health=1.0, health_max=1.0, radius=0.5,
+                                   build_progress=random.choice([0.5, 1.0])),
+        int_attr=SimpleNamespace(alliance=random.choice([1, 3, 4])),
+        bool_attr=SimpleNamespace(is_flying=False),
+        orders=[SimpleNamespace(ability_id=random.randint(1, 20), target_tag=0)
+                for _ in range(random.randint(0, 1))])
+
+  def linear_queries(units, type_list, ability_id):
+    self_units = [u for u in units if u.int_attr.alliance == 1]
+    type_set = set(type_list)
+    of_types = [u for u in self_units if u.unit_type in type_set]
+    mature = [u for u in of_types if u.float_attr.build_progress >= 1.0]
+    idle = [u for u in mature if len(u.orders) == 0]
+    tasks = [u for u in self_units
+             if ability_id in set([order.ability_id for order in u.orders])]
+    return of_types, mature, idle, tasks
+
+  def indexed_queries(dc, type_list, ability_id):
+    return (dc.units_of_types(type_list),
+            dc.mature_units_of_types(type_list),
+            dc.idle_units_of_types(type_list),
+            dc.units_with_task(ability_id))
+
+  num_queries = 300
+  for num_units in (200, 400, 600):
+    units = [random_unit(tag) for tag in range(num_units)]
+    observation = {'units': units, 'player': np.zeros(11), 'raw_data': None}
+    dc = DataContext()
+    queries = [([u.value for u in random.sample(list(UNIT_TYPE), 3)],
+                random.randint(1, 20)) for _ in range(num_queries)]
+    t = time.time()
+    for type_list, ability_id in queries:
+      linear_queries(units, type_list, ability_id)
+    linear_time = time.time() - t
+    t = time.time()
+    dc.update(observation)
+    for type_list, ability_id in queries:
+      indexed_queries(dc, type_list, ability_id)
+    indexed_time = time.time() - t
+    print("Units: %d	Linear: %.2fms	Indexed (incl. update): %.2fms	"
+          "Speedup: %.1fx" % (num_units, linear_time * 1000,
+                              indexed_time * 1000, linear_time / indexed_time))
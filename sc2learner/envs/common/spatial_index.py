@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class GridIndex(object):
+
+  def __init__(self, positions, ids=None, cell_size=8.0):
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    ids = np.arange(len(positions)) if ids is None \
+        else np.asarray(ids, dtype=np.int64)
+    self._cell_size = cell_size
+    points = positions[ids]
+    if len(points) > 0:
+      self._origin = points.min(axis=0)
+      self._extent = points.max(axis=0)
+    else:
+      self._origin = self._extent = np.zeros(2)
+    self._num_x, self._num_y = (np.floor(
+        (self._extent - self._origin) / cell_size).astype(np.int64) + 1)
+    cells = self._cells_of(points)
+    order = np.argsort(cells, kind='stable')
+    self._ids = ids[order]
+    self._points = points[order]
+    self._cell_starts = np.concatenate(([0], np.cumsum(
+        np.bincount(cells, minlength=self._num_x * self._num_y))))
+
+  def __len__(self):
+    return len(self._ids)
+
+  def query_radius(self, points, max_distance):
+    # pairs come sorted by point and id, as a linear scan would find them
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    point_ids, candidates = self._candidates(points, max_distance)
+    diff = self._points[candidates] - points[point_ids]
+    dist = np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1])
+    within = dist <= max_distance
+    point_ids, ids = point_ids[within], self._ids[candidates[within]]
+    order = np.lexsort((ids, point_ids))
+    return point_ids[order], ids[order]
+
+  def count_within(self, points, max_distance):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    point_ids, _ = self.query_radius(points, max_distance)
+    return np.bincount(point_ids, minlength=len(points))
+
+  def nearest(self, points):
+    # ties go to the smaller id, as min() over a list in id order would do
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    nearest_ids = np.full(len(points), -1, dtype=np.int64)
+    nearest_dist = np.full(len(points), np.inf)
+    if len(self._ids) == 0: return nearest_ids, nearest_dist
+    pending = np.arange(len(points))
+    radius = self._cell_size
+    while len(pending) > 0:
+      pending_points = points[pending]
+      point_ids, candidates = self._candidates(pending_points, radius)
+      diff = self._points[candidates] - pending_points[point_ids]
+      dist = np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1])
+      ids = self._ids[candidates]
+      order = np.lexsort((ids, dist, point_ids))
+      point_ids, ids, dist = point_ids[order], ids[order], dist[order]
+      first = np.ones(len(point_ids), dtype=bool)
+      first[1:] = point_ids[1:] != point_ids[:-1]
+      point_ids, ids, dist = point_ids[first], ids[first], dist[first]
+      # a hit is final once every unit within its distance was a candidate
+      farthest = np.max(np.abs(np.concatenate(
+          (pending_points - self._origin, pending_points - self._extent),
+          axis=1)), axis=1) * 2 ** 0.5
+      done = np.zeros(len(pending), dtype=bool)
+      done[point_ids[dist <= radius]] = True
+      done |= farthest <= radius
+      found = done[point_ids]
+      nearest_ids[pending[point_ids[found]]] = ids[found]
+      nearest_dist[pending[point_ids[found]]] = dist[found]
+      pending = pending[~done]
+      radius *= 2
+    return nearest_ids, nearest_dist
+
+  def _cells_of(self, points):
+    cell_x, cell_y = self._cell_coords(points)
+    return cell_y * self._num_x + cell_x
+
+  def _cell_coords(self, points):
+    coords = np.floor((points - self._origin) / self._cell_size)
+    cell_x = np.clip(coords[:, 0], 0, self._num_x - 1).astype(np.int64)
+    cell_y = np.clip(coords[:, 1], 0, self._num_y - 1).astype(np.int64)
+    return cell_x, cell_y
+
+  def _candidates(self, points, radius):
+    x_min, y_min = self._cell_coords(points - radius)
+    x_max, y_max = self._cell_coords(points + radius)
+    # every cell row of a query box is one contiguous run of sorted entries
+    num_rows = y_max - y_min + 1
+    row_point_ids = np.repeat(np.arange(len(points)), num_rows)
+    row_y = np.arange(num_rows.sum()) - np.repeat(
+        np.cumsum(num_rows) - num_rows, num_rows) + y_min[row_point_ids]
+    starts = self._cell_starts[row_y * self._num_x + x_min[row_point_ids]]
+    ends = self._cell_starts[row_y * self._num_x + x_max[row_point_ids] + 1]
+    lengths = ends - starts
+    point_ids = np.repeat(row_point_ids, lengths)
+    candidates = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    return point_ids, candidates
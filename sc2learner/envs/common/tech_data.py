@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import namedtuple
+
+from pysc2.lib.tech_tree import TechTree
+
+
+TechData = namedtuple('TechData', ('required_units',
+                                   'required_upgrades',
+                                   'mineral_cost',
+                                   'gas_cost',
+                                   'supply_cost',
+                                   'builders',
+                                   'build_ability'))
+
+_TECH_TREES = {}
+_TECH_DATA = {}
+
+
+def tech_tree(game_version):
+  if game_version not in _TECH_TREES:
+    tree = TechTree()
+    tree.update_version(game_version)
+    _TECH_TREES[game_version] = tree
+  return _TECH_TREES[game_version]
+
+
+def unit_data(type_id, game_version):
+  key = ('unit', type_id, game_version)
+  if key not in _TECH_DATA:
+    _TECH_DATA[key] = _tech_data(tech_tree(game_version).getUnitData(type_id))
+  return _TECH_DATA[key]
+
+
+def upgrade_data(upgrade_id, game_version):
+  key = ('upgrade', upgrade_id, game_version)
+  if key not in _TECH_DATA:
+    _TECH_DATA[key] = _tech_data(
+        tech_tree(game_version).getUpgradeData(upgrade_id))
+  return _TECH_DATA[key]
+
+
+def _tech_data(tech):
+  return TechData(required_units=tuple(tech.requiredUnits),
+                  required_upgrades=tuple(tech.requiredUpgrades),
+                  mineral_cost=tech.mineralCost,
+                  gas_cost=tech.gasCost,
+                  supply_cost=tech.supplyCost,
+                  builders=tuple(tech.whatBuilds),
+                  build_ability=tech.buildAbility)
@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+COLUMNS = (
+    ('tag', np.uint64),
+    ('unit_type', np.int32),
+    ('alliance', np.int32),
+    ('pos_x', np.float64),
+    ('pos_y', np.float64),
+    ('health', np.float64),
+    ('health_max', np.float64),
+    ('build_progress', np.float64),
+    ('radius', np.float64),
+    ('is_flying', np.bool_),
+    ('num_orders', np.int32),
+    ('order_ability_id', np.int32),
+    ('order_target_tag', np.uint64),
+)
+
+
+def _unit_row(u):
+  float_attr = u.float_attr
+  orders = u.orders
+  if len(orders) > 0:
+    order_ability_id, order_target_tag = \
+        orders[0].ability_id, orders[0].target_tag
+  else:
+    order_ability_id, order_target_tag = 0, 0
+  return (u.tag,
+          u.unit_type,
+          u.int_attr.alliance,
+          float_attr.pos_x,
+          float_attr.pos_y,
+          float_attr.health,
+          float_attr.health_max,
+          float_attr.build_progress,
+          float_attr.radius,
+          u.bool_attr.is_flying,
+          len(orders),
+          order_ability_id,
+          order_target_tag)
+
+
+class UnitTable(object):
+
+  def __init__(self, units):
+    self._units = units
+    rows = [_unit_row(u) for u in units]
+    columns = list(zip(*rows)) if len(rows) > 0 else [()] * len(COLUMNS)
+    for (name, dtype), column in zip(COLUMNS, columns):
+      setattr(self, name, np.array(column, dtype=dtype))
+    self._positions = None
+
+  def __len__(self):
+    return len(self._units)
+
+  def unit(self, index):
+    return self._units[index]
+
+  def units_at(self, indices):
+    return [self._units[i] for i in indices]
+
+  def indices(self, mask):
+    return np.nonzero(mask)[0]
+
+  @property
+  def units(self):
+    return self._units
+
+  @property
+  def positions(self):
+    if self._positions is None:
+      self._positions = np.stack((self.pos_x, self.pos_y), axis=1)
+    return self._positions
+
+
+class IdLookup(object):
+
+  def __init__(self, mapping):
+    keys = np.array(sorted(mapping.keys()), dtype=np.int64)
+    self._keys = keys if len(keys) > 0 else np.array([-1], dtype=np.int64)
+    self._values = np.array([mapping[k] for k in keys] or [-1],
+                            dtype=np.int64)
+
+  def __call__(self, ids):
+    pos = np.searchsorted(self._keys, ids)
+    pos = np.minimum(pos, len(self._keys) - 1)
+    return np.where(self._keys[pos] == ids, self._values[pos], -1)
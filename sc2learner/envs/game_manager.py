@@ -0,0 +1,231 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+
+from sc2learner.utils.utils import tprint
+
+
+class GameInstanceManager(object):
+
+  def __init__(self, create_fn, seed_fn, max_retry=10, backoff=1.0,
+               max_backoff=30.0):
+    self._create_fn = create_fn
+    self._seed_fn = seed_fn
+    self._max_retry = max_retry
+    self._backoff = backoff
+    self._max_backoff = max_backoff
+    self._game = None
+    self._game_is_new = False
+    self._standby = None
+    self._standby_thread = None
+    self._timings = {}
+
+  @property
+  def game(self):
+    if self._game is None:
+      self._game = self._take_standby() or self._create(self._seed_fn())
+      self._game_is_new = True
+    return self._game
+
+  @property
+  def timings(self):
+    return dict(self._timings)
+
+  def prepare_next(self):
+    # launches the game for the next episode while the current one runs
+    if self._standby is not None or self._standby_thread is not None: return
+    # seeds are drawn here so the launch thread never touches the caller
+    seed = self._seed_fn()
+
+    def launch():
+      try:
+        self._standby = self._create(seed)
+      except Exception as e:
+        tprint("Standby game launch failed: %s" % e)
+
+    self._standby_thread = threading.Thread(target=launch)
+    self._standby_thread.daemon = True
+    self._standby_thread.start()
+
+  def reset(self):
+    # a launched standby replaces the live game, otherwise the live game is
+    # restarted in place; a game failing to reset is replaced by the standby
+    # if one is on its way, or relaunched after backoff
+    if self._standby_thread is not None and \
+        not self._standby_thread.is_alive():
+      standby = self._take_standby()
+      if standby is not None:
+        self._discard()
+        self._game = standby
+        self._game_is_new = True
+    for attempt in range(self._max_retry):
+      game = self.game
+      try:
+        start_time = time.time()
+        timesteps = game.reset()
+        self._timings['first_observation'] = time.time() - start_time
+        if self._game_is_new:
+          tprint("Game timings: %s" % ", ".join(
+              "%s %.2fs" % item for item in sorted(self._timings.items())))
+          self._game_is_new = False
+        return timesteps
+      except Exception as e:
+        if attempt == self._max_retry - 1: raise
+        tprint("Game reset failed (attempt %d/%d): %s" %
+               (attempt + 1, self._max_retry, e))
+        self._discard()
+        if self._standby is None and self._standby_thread is None:
+          self._wait(attempt)
+
+  def close(self):
+    standby = self._take_standby()
+    if standby is not None: standby.close()
+    if self._game is not None: self._game.close()
+    self._game = None
+
+  def _take_standby(self):
+    if self._standby_thread is not None:
+      start_time = time.time()
+      self._standby_thread.join()
+      self._standby_thread = None
+      self._timings['join'] = time.time() - start_time
+    standby, self._standby = self._standby, None
+    return standby
+
+  def _create(self, seed):
+    for attempt in range(self._max_retry):
+      try:
+        start_time = time.time()
+        game = self._create_fn(seed)
+        self._timings['launch'] = time.time() - start_time
+        return game
+      except Exception as e:
+        if attempt == self._max_retry - 1: raise
+        tprint("Game launch failed (attempt %d/%d): %s" %
+               (attempt + 1, self._max_retry, e))
+        self._wait(attempt)
+
+  def _discard(self):
+    game, self._game = self._game, None
+    if game is None: return
+    try:
+      game.close()
+    except Exception as e:
+      tprint("Closing a game raised: %s" % e)
+
+  def _wait(self, attempt):
+    time.sleep(min(self._backoff * 2 ** attempt, self._max_backoff))
+
+
+if __name__ == '__main__':
+
+  class StandInGame(object):
+
+    def __init__(self, game_id, failed_resets=0):
+      self.game_id = game_id
+      self.failed_resets = failed_resets
+      self.num_resets = 0
+      self.closed = False
+
+    def reset(self):
+      if self.failed_resets > 0:
+        self.failed_resets -= 1
+        raise RuntimeError("stand-in game %d crashed" % self.game_id)
+      self.num_resets += 1
+      return [self.game_id]
+
+    def close(self):
+      self.closed = True
+
+  def stand_in_factory(failed_resets=(), failed_launches=0, launch_gate=None):
+    games, seeds, launches = [], [], [0]
+
+    def create(seed):
+      launches[0] += 1
+      if launches[0] <= failed_launches:
+        raise IOError("stand-in launch %d failed" % launches[0])
+      if launch_gate is not None and len(games) > 0: launch_gate.wait()
+      failures = failed_resets[len(games)] if len(games) < len(failed_resets) \
+          else 0
+      games.append(StandInGame(len(games), failures))
+      seeds.append(seed)
+      return games[-1]
+
+    return create, games, seeds
+
+  def counter():
+    count = [0]
+
+    def next_seed():
+      count[0] += 1
+      return count[0]
+
+    return next_seed
+
+  # the live game is restarted in place across episodes
+  create, games, seeds = stand_in_factory()
+  manager = GameInstanceManager(create, counter(), backoff=0)
+  for _ in range(3):
+    assert manager.reset() == [0]
+  assert len(games) == 1 and games[0].num_resets == 3
+
+  # a launched standby takes over at the next reset, with its seed drawn
+  # on the calling thread
+  manager.prepare_next()
+  manager._standby_thread.join()
+  assert manager.reset() == [1]
+  assert games[0].closed and len(games) == 2 and seeds == [1, 2]
+  assert all(k in manager.timings
+             for k in ['launch', 'join', 'first_observation'])
+
+  # a standby still launching leaves the live game to restart in place
+  launch_gate = threading.Event()
+  create, games, seeds = stand_in_factory(launch_gate=launch_gate)
+  manager = GameInstanceManager(create, counter(), backoff=0)
+  manager.game
+  manager.prepare_next()
+  assert manager.reset() == [0] and len(games) == 1
+  launch_gate.set()
+  manager._standby_thread.join()
+  assert manager.reset() == [1] and games[0].closed
+
+  # a crashed game is replaced by the standby still launching, without
+  # backing off
+  launch_gate = threading.Event()
+  create, games, seeds = stand_in_factory(failed_resets=(1,),
+                                          launch_gate=launch_gate)
+  manager = GameInstanceManager(create, counter(), backoff=3600)
+  waits = []
+  manager._wait = waits.append
+  manager.game
+  manager.prepare_next()
+  threading.Timer(0.1, launch_gate.set).start()
+  assert manager.reset() == [1]
+  assert games[0].closed and games[0].num_resets == 0 and waits == []
+  manager.close()
+  assert games[1].closed
+
+  # without a standby, a crashed game is relaunched after backoff
+  create, games, seeds = stand_in_factory(failed_resets=(1,))
+  manager = GameInstanceManager(create, counter(), backoff=0)
+  waits = []
+  manager._wait = waits.append
+  assert manager.reset() == [1] and games[0].closed and waits == [0]
+  assert seeds == [1, 2]
+
+  # launches are retried with bounded backoff and fail after max_retry
+  create, games, seeds = stand_in_factory(failed_launches=2)
+  manager = GameInstanceManager(create, counter(), backoff=0.01,
+                                max_backoff=0.02)
+  assert manager.reset() == [0]
+  create, games, seeds = stand_in_factory(failed_launches=3)
+  manager = GameInstanceManager(create, counter(), max_retry=3, backoff=0)
+  try:
+    manager.reset()
+    assert False
+  except IOError:
+    pass
+  print("Stand-in game checks passed.")
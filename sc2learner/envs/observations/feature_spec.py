@@ -0,0 +1,177 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import namedtuple
+from collections import OrderedDict
+
+import numpy as np
+from pysc2.lib.typeenums import UNIT_TYPEID as UNIT_TYPE
+
+from sc2learner.envs.observations.nonspatial_features import PlayerFeature
+from sc2learner.envs.observations.nonspatial_features import ScoreFeature
+from sc2learner.envs.observations.nonspatial_features import WorkerFeature
+from sc2learner.envs.observations.nonspatial_features import UnitTypeCountFeature
+from sc2learner.envs.observations.nonspatial_features import UnitStatCountFeature
+from sc2learner.envs.observations.nonspatial_features import GameProgressFeature
+from sc2learner.envs.observations.nonspatial_features import ActionSeqFeature
+from sc2learner.envs.observations.nonspatial_features import ActionMaskFeature
+from sc2learner.envs.observations.nonspatial_features import RegionBinning
+from sc2learner.envs.observations.nonspatial_features import alliance_index
+
+
+BlockSpec = namedtuple('BlockSpec',
+                       ['name', 'kind', 'type_list', 'use_regions', 'scale'])
+BlockSpec.__new__.__defaults__ = (None, False, 20)
+
+
+ZERG_UNIT_TYPES = [UNIT_TYPE.ZERG_LARVA.value,
+                   UNIT_TYPE.ZERG_DRONE.value,
+                   UNIT_TYPE.ZERG_ZERGLING.value,
+                   UNIT_TYPE.ZERG_BANELING.value,
+                   UNIT_TYPE.ZERG_ROACH.value,
+                   UNIT_TYPE.ZERG_ROACHBURROWED.value,
+                   UNIT_TYPE.ZERG_RAVAGER.value,
+                   UNIT_TYPE.ZERG_HYDRALISK.value,
+                   UNIT_TYPE.ZERG_LURKERMP.value,
+                   UNIT_TYPE.ZERG_LURKERMPBURROWED.value,
+                   #UNIT_TYPE.ZERG_VIPER.value,
+                   UNIT_TYPE.ZERG_MUTALISK.value,
+                   UNIT_TYPE.ZERG_CORRUPTOR.value,
+                   UNIT_TYPE.ZERG_BROODLORD.value,
+                   #UNIT_TYPE.ZERG_SWARMHOSTMP.value,
+                   UNIT_TYPE.ZERG_LOCUSTMP.value,
+                   #UNIT_TYPE.ZERG_INFESTOR.value,
+                   UNIT_TYPE.ZERG_ULTRALISK.value,
+                   UNIT_TYPE.ZERG_BROODLING.value,
+                   UNIT_TYPE.ZERG_OVERLORD.value,
+                   UNIT_TYPE.ZERG_OVERSEER.value,
+                   #UNIT_TYPE.ZERG_CHANGELING.value,
+                   UNIT_TYPE.ZERG_QUEEN.value]
+
+
+ZERG_BUILDING_TYPES = [UNIT_TYPE.ZERG_SPINECRAWLER.value,
+                       UNIT_TYPE.ZERG_SPORECRAWLER.value,
+                       #UNIT_TYPE.ZERG_NYDUSCANAL.value,
+                       UNIT_TYPE.ZERG_EXTRACTOR.value,
+                       UNIT_TYPE.ZERG_SPAWNINGPOOL.value,
+                       UNIT_TYPE.ZERG_ROACHWARREN.value,
+                       UNIT_TYPE.ZERG_HYDRALISKDEN.value,
+                       UNIT_TYPE.ZERG_HATCHERY.value,
+                       UNIT_TYPE.ZERG_EVOLUTIONCHAMBER.value,
+                       UNIT_TYPE.ZERG_BANELINGNEST.value,
+                       UNIT_TYPE.ZERG_INFESTATIONPIT.value,
+                       UNIT_TYPE.ZERG_SPIRE.value,
+                       UNIT_TYPE.ZERG_ULTRALISKCAVERN.value,
+                       #UNIT_TYPE.ZERG_NYDUSNETWORK.value,
+                       UNIT_TYPE.ZERG_LURKERDENMP.value,
+                       UNIT_TYPE.ZERG_LAIR.value,
+                       UNIT_TYPE.ZERG_HIVE.value,
+                       UNIT_TYPE.ZERG_GREATERSPIRE.value]
+
+
+def zerg_nonspatial_spec(use_regions=False, use_game_progress=True,
+                         use_action_mask=True):
+  spec = [
+      BlockSpec('unit_type', 'unit_type_count', type_list=ZERG_UNIT_TYPES,
+                use_regions=use_regions),
+      BlockSpec('building_type', 'unit_type_count',
+                type_list=ZERG_BUILDING_TYPES),
+      BlockSpec('unit_stat', 'unit_stat_count', use_regions=use_regions),
+      BlockSpec('player', 'player'),
+      BlockSpec('score', 'score'),
+      BlockSpec('worker', 'worker'),
+      BlockSpec('action_seq', 'action_seq'),
+  ]
+  if use_game_progress:
+    spec.append(BlockSpec('game_progress', 'game_progress'))
+  if use_action_mask:
+    spec.append(BlockSpec('action_mask', 'action_mask'))
+  return spec
+
+
+class CompiledFeatureSpec(object):
+
+  def __init__(self, spec, n_actions, action_seq_len):
+    assert len(set(block.name for block in spec)) == len(spec)
+    self._action_seq_feature = ActionSeqFeature(n_actions, action_seq_len)
+    self._layout = OrderedDict()
+    self._count_blocks, self._blocks = [], []
+    num_dims, num_counts = 0, 0
+    for block in spec:
+      feature, inputs = self._compile_block(block, n_actions)
+      self._layout[block.name] = slice(num_dims, num_dims + feature.num_dims)
+      if inputs == 'units':
+        self._count_blocks.append((feature, num_dims, num_counts))
+        num_counts += feature.num_counts
+      else:
+        self._blocks.append((feature, num_dims, inputs))
+      num_dims += feature.num_dims
+    self._num_dims, self._num_counts = num_dims, num_counts
+    self._binning = RegionBinning(
+        any(block.use_regions for block in spec
+            if block.kind in ('unit_type_count', 'unit_stat_count')))
+
+  def features_into(self, out, observation, dc, need_flip=False):
+    assert len(out) == self._num_dims
+    if len(self._count_blocks) > 0:
+      self._counts_into(out, dc.unit_table, need_flip)
+    for feature, offset, inputs in self._blocks:
+      if inputs == 'observation':
+        feature.features_into(out, offset, observation)
+      elif inputs == 'dc':
+        feature.features_into(out, offset, dc)
+      else:
+        feature.features_into(out, offset)
+
+  def features(self, observation, dc, need_flip=False):
+    out = np.empty(self._num_dims, dtype=np.float32)
+    self.features_into(out, observation, dc, need_flip)
+    return out
+
+  def push_action(self, action):
+    self._action_seq_feature.push_action(action)
+
+  def reset(self):
+    self._action_seq_feature.reset()
+
+  @property
+  def layout(self):
+    return self._layout
+
+  @property
+  def num_dims(self):
+    return self._num_dims
+
+  def _counts_into(self, out, unit_table, need_flip):
+    # one region assignment and one bincount shared by all count blocks
+    region_ids, unit_ids = self._binning.assign(unit_table)
+    alliance_ids = alliance_index(unit_table.alliance[unit_ids])
+    keys = [feature.count_keys(unit_table, region_ids, unit_ids, alliance_ids)
+            + key_offset for feature, _, key_offset in self._count_blocks]
+    counts = np.bincount(np.concatenate(keys), minlength=self._num_counts)
+    for feature, offset, key_offset in self._count_blocks:
+      feature.counts_into(
+          out, offset, counts[key_offset:key_offset + feature.num_counts],
+          need_flip)
+
+  def _compile_block(self, block, n_actions):
+    if block.kind == 'unit_type_count':
+      return UnitTypeCountFeature(block.type_list, block.use_regions,
+                                  block.scale), 'units'
+    elif block.kind == 'unit_stat_count':
+      return UnitStatCountFeature(block.use_regions, block.scale), 'units'
+    elif block.kind == 'player':
+      return PlayerFeature(), 'observation'
+    elif block.kind == 'score':
+      return ScoreFeature(), 'observation'
+    elif block.kind == 'game_progress':
+      return GameProgressFeature(), 'observation'
+    elif block.kind == 'action_mask':
+      return ActionMaskFeature(n_actions), 'observation'
+    elif block.kind == 'worker':
+      return WorkerFeature(), 'dc'
+    elif block.kind == 'action_seq':
+      return self._action_seq_feature, None
+    else:
+      raise NotImplementedError
@@ -8,192 +8,206 @@ from pysc2.lib.typeenums import ABILITY_ID as ABILITY
 
 from sc2learner.envs.common.const import ALLY_TYPE
 from sc2learner.envs.common.const import COMBAT_TYPES
+from sc2learner.envs.common.unit_table import IdLookup
 
 
-class PlayerFeature(object):
+class FeatureBlock(object):
 
-  def features(self, observation):
-    player_features = observation["player"][1:-1].astype(np.float32)
+  def features(self, *args, **kwargs):
+    out = np.empty(self.num_dims, dtype=np.float32)
+    self.features_into(out, 0, *args, **kwargs)
+    return out
+
+
+class PlayerFeature(FeatureBlock):
+
+  def __init__(self):
+    self._scale = np.array([2000, 2000, 20, 20, 20, 20, 20, 20, 20],
+                           np.float32)
+
+  def features_into(self, out, offset, observation):
+    player_features = out[offset:offset + 9]
+    log_features = out[offset + 9:offset + 18]
+    bins_food_unused = out[offset + 18:offset + 28]
+    player_features[:] = observation["player"][1:-1]
     food_unused = player_features[3] - player_features[2]
     player_features[-1] = food_unused if food_unused >= 0 else 0
-    scale = np.array([2000, 2000, 20, 20, 20, 20, 20, 20, 20], np.float32)
-    scaled_features = (player_features / scale).astype(np.float32)
-    log_features = np.log10(player_features + 1).astype(np.float32)
+    np.add(player_features, 1, out=log_features)
+    np.log10(log_features, out=log_features)
+    np.divide(player_features, self._scale, out=player_features)
 
-    bins_food_unused = np.zeros(10, dtype=np.float32)
+    bins_food_unused.fill(0)
     bin_id = int((max(food_unused, 0) - 1) // 3 + 1) if food_unused <= 27 else 9
     bins_food_unused[bin_id] = 1
-    return np.concatenate((scaled_features, log_features, bins_food_unused))
 
   @property
   def num_dims(self):
     return 9 * 2 + 10
 
 
-class ScoreFeature(object):
+class ScoreFeature(FeatureBlock):
 
-  def features(self, observation):
-    score_features = observation.score_cumulative[3:].astype(np.float32)
+  def features_into(self, out, offset, observation):
+    score_features = out[offset:offset + 10]
+    log_features = out[offset + 10:offset + 20]
+    score_features[:] = observation.score_cumulative[3:]
     score_features /= 3000.0
-    log_features = np.log10(score_features + 1).astype(np.float32)
-    return np.concatenate((score_features, log_features))
+    np.add(score_features, 1, out=log_features)
+    np.log10(log_features, out=log_features)
 
   @property
   def num_dims(self):
     return 10 * 2
 
 
-class UnitTypeCountFeature(object):
+REGIONS = [(0, 0, 200, 176),
+           (0, 88, 80, 176),
+           (80, 88, 120, 176),
+           (120, 88, 200, 176),
+           (0, 55, 80, 88),
+           (80, 55, 120, 88),
+           (120, 55, 200, 88),
+           (0, 0, 80, 55),
+           (80, 0, 120, 55),
+           (120, 0, 200, 55)]
 
-  def __init__(self, type_list, use_regions=False):
-    self._type_list = type_list
-    if use_regions:
-      self._regions = [(0, 0, 200, 176),
-                       (0, 88, 80, 176),
-                       (80, 88, 120, 176),
-                       (120, 88, 200, 176),
-                       (0, 55, 80, 88),
-                       (80, 55, 120, 88),
-                       (120, 55, 200, 88),
-                       (0, 0, 80, 55),
-                       (80, 0, 120, 55),
-                       (120, 0, 200, 55)]
-    else:
-      self._regions = [(0, 0, 200, 176)]
-    self._regions_flipped = [self._regions[0]] + [
-        self._regions[10 - i] for i in range(1, len(self._regions))]
-
-  def features(self, observation, need_flip=False):
-    feature_list = []
-    for region in (self._regions if not need_flip else self._regions_flipped):
-      units_in_region = [u for u in observation['units']
-                         if self._is_in_region(u, region)]
-      feature_list.append(self._generate_features(units_in_region))
-    return np.concatenate(feature_list)
+
+class RegionBinning(object):
+
+  def __init__(self, use_regions=False):
+    self._regions = REGIONS if use_regions else REGIONS[:1]
+    bounds = np.array(self._regions, dtype=np.float64)
+    self._x_min, self._y_min = bounds[:, 0:1], bounds[:, 1:2]
+    self._x_max, self._y_max = bounds[:, 2:3], bounds[:, 3:4]
+    # a flipped view lists region 10 - i at position i (region 0 stays)
+    self._flip_order = np.array(
+        [0] + [10 - i for i in range(1, len(self._regions))], dtype=np.int64)
+
+  def __len__(self):
+    return len(self._regions)
+
+  def assign(self, unit_table):
+    x, y = unit_table.pos_x, unit_table.pos_y
+    inside = ((x >= self._x_min) & (x < self._x_max) &
+              (y >= self._y_min) & (y < self._y_max))
+    return np.nonzero(inside)
+
+  def order(self, need_flip):
+    return self._flip_order if need_flip else slice(None)
+
+
+alliance_index = IdLookup({ALLY_TYPE.SELF.value: 0, ALLY_TYPE.ENEMY.value: 1})
+
+
+def _scale_and_log_into(out, offset, counts, scale):
+  num_rows, num_cols = counts.shape
+  features = out[offset:offset + num_rows * num_cols * 2].reshape(
+      num_rows, 2, num_cols)
+  scaled_features, log_features = features[:, 0], features[:, 1]
+  scaled_features[:] = counts
+  np.add(scaled_features, 1, out=log_features)
+  np.log10(log_features, out=log_features)
+  scaled_features /= scale
+
+
+class RegionCountFeature(FeatureBlock):
+
+  def __init__(self, use_regions=False, scale=20):
+    self._binning = RegionBinning(use_regions)
+    self._scale = scale
+
+  def features_into(self, out, offset, dc, need_flip=False):
+    unit_table = dc.unit_table
+    region_ids, unit_ids = self._binning.assign(unit_table)
+    alliance_ids = alliance_index(unit_table.alliance[unit_ids])
+    counts = np.bincount(
+        self.count_keys(unit_table, region_ids, unit_ids, alliance_ids),
+        minlength=self.num_counts)
+    self.counts_into(out, offset, counts, need_flip)
+
+  def counts_into(self, out, offset, counts, need_flip=False):
+    counts = counts.reshape(len(self._binning), -1)
+    _scale_and_log_into(out, offset, counts[self._binning.order(need_flip)],
+                        self._scale)
+
+  @property
+  def num_regions(self):
+    return len(self._binning)
 
   @property
   def num_dims(self):
-    return len(self._type_list) * len(self._regions) * 2 * 2
+    return self.num_counts * 2
 
-  def _generate_features(self, units):
-    self_units = [u for u in units
-                  if u.int_attr.alliance == ALLY_TYPE.SELF.value]
-    enemy_units = [u for u in units
-                   if u.int_attr.alliance == ALLY_TYPE.ENEMY.value]
-    self_features = self._get_counts(self_units)
-    enemy_features = self._get_counts(enemy_units)
-    features = np.concatenate((self_features, enemy_features))
+  def _in_regions(self, region_ids, *arrays):
+    keep = region_ids < len(self._binning)
+    return [region_ids[keep]] + [array[keep] for array in arrays]
 
-    scaled_features = features / 20
-    log_features = np.log10(features + 1)
 
-    return np.concatenate((scaled_features, log_features))
+class UnitTypeCountFeature(RegionCountFeature):
 
-  def _get_counts(self, units):
-    count = {t: 0 for t in self._type_list}
-    for u in units:
-      if u.unit_type in count:
-        count[u.unit_type] += 1
-    return np.array([count[t] for t in self._type_list], dtype=np.float32)
+  def __init__(self, type_list, use_regions=False, scale=20):
+    super(UnitTypeCountFeature, self).__init__(use_regions, scale)
+    assert len(set(type_list)) == len(type_list)
+    self._type_list = type_list
+    self._type_index = IdLookup({t: i for i, t in enumerate(type_list)})
 
-  def _is_in_region(self, unit, region):
-    return (unit.float_attr.pos_x >= region[0] and
-            unit.float_attr.pos_x < region[2] and
-            unit.float_attr.pos_y >= region[1] and
-            unit.float_attr.pos_y < region[3])
+  def count_keys(self, unit_table, region_ids, unit_ids, alliance_ids):
+    region_ids, unit_ids, alliance_ids = self._in_regions(
+        region_ids, unit_ids, alliance_ids)
+    num_types = len(self._type_list)
+    type_ids = self._type_index(unit_table.unit_type[unit_ids])
+    valid = (alliance_ids >= 0) & (type_ids >= 0)
+    return (region_ids[valid] * 2 + alliance_ids[valid]) * num_types + \
+        type_ids[valid]
 
+  @property
+  def num_counts(self):
+    return len(self._type_list) * len(self._binning) * 2
 
-class UnitStatCountFeature(object):
 
-  def __init__(self, use_regions=False):
-    if use_regions:
-      self._regions = [(0, 0, 200, 176),
-                       (0, 88, 80, 176),
-                       (80, 88, 120, 176),
-                       (120, 88, 200, 176),
-                       (0, 55, 80, 88),
-                       (80, 55, 120, 88),
-                       (120, 55, 200, 88),
-                       (0, 0, 80, 55),
-                       (80, 0, 120, 55),
-                       (120, 0, 200, 55)]
-    else:
-      self._regions = [(0, 0, 200, 176)]
-    self._regions_flipped = [self._regions[0]] + [
-        self._regions[10 - i] for i in range(1, len(self._regions))]
-
-  def features(self, observation, need_flip=False):
-    feature_list = []
-    for region in (self._regions if not need_flip else self._regions_flipped):
-      units_in_region = [u for u in observation['units']
-                         if self._is_in_region(u, region)]
-      feature_list.append(self._generate_features(units_in_region))
-    return np.concatenate(feature_list)
+class UnitStatCountFeature(RegionCountFeature):
+
+  def __init__(self, use_regions=False, scale=20):
+    super(UnitStatCountFeature, self).__init__(use_regions, scale)
+    self._combat_types = np.array(sorted(COMBAT_TYPES), dtype=np.int64)
+
+  def count_keys(self, unit_table, region_ids, unit_ids, alliance_ids):
+    region_ids, unit_ids, alliance_ids = self._in_regions(
+        region_ids, unit_ids, alliance_ids)
+    valid = alliance_ids >= 0
+    region_ids, unit_ids = region_ids[valid], unit_ids[valid]
+    base = (region_ids * 2 + alliance_ids[valid]) * 4
+    is_combat = np.isin(unit_table.unit_type[unit_ids], self._combat_types)
+    is_flying = unit_table.is_flying[unit_ids]
+    # per alliance: all, combats, ground, air
+    return np.concatenate((base, base[is_combat] + 1, base + 2 + is_flying))
 
   @property
-  def num_dims(self):
-    return len(self._regions) * 2 * 4 * 2
-
-  def _generate_features(self, units):
-    self_units = [u for u in units
-                  if u.int_attr.alliance == ALLY_TYPE.SELF.value]
-    enemy_units = [u for u in units
-                   if u.int_attr.alliance == ALLY_TYPE.ENEMY.value]
-    self_combats = [u for u in self_units if u.unit_type in COMBAT_TYPES]
-    enemy_combats = [u for u in enemy_units if u.unit_type in COMBAT_TYPES]
-    self_air_units = [u for u in self_units if u.bool_attr.is_flying]
-    enemy_air_units = [u for u in enemy_units if u.bool_attr.is_flying]
-    self_ground_units = [u for u in self_units if not u.bool_attr.is_flying]
-    enemy_ground_units = [u for u in enemy_units if not u.bool_attr.is_flying]
-
-    features = np.array([len(self_units),
-                         len(self_combats),
-                         len(self_ground_units),
-                         len(self_air_units),
-                         len(enemy_units),
-                         len(enemy_combats),
-                         len(enemy_ground_units),
-                         len(enemy_air_units)], dtype=np.float32)
-
-    scaled_features = features / 20
-    log_features = np.log10(features + 1)
-    return np.concatenate((scaled_features, log_features))
-
-  def _is_in_region(self, unit, region):
-    return (unit.float_attr.pos_x >= region[0] and
-            unit.float_attr.pos_x < region[2] and
-            unit.float_attr.pos_y >= region[1] and
-            unit.float_attr.pos_y < region[3])
-
-
-class GameProgressFeature(object):
-
-  def features(self, observation):
-    game_loop = observation["game_loop"][0]
-    features_60 = self._onehot(game_loop, 60)
-    features_20 = self._onehot(game_loop, 20)
-    features_8 = self._onehot(game_loop, 8)
-    features_4 = self._onehot(game_loop, 4)
+  def num_counts(self):
+    return len(self._binning) * 2 * 4
+
 
-    return np.concatenate([features_60,
-                           features_20,
-                           features_8,
-                           features_4])
+class GameProgressFeature(FeatureBlock):
 
-  def _onehot(self, value, n_bins):
+  def features_into(self, out, offset, observation):
+    game_loop = observation["game_loop"][0]
+    features = out[offset:offset + self.num_dims]
+    features.fill(0)
+    for n_bins in [60, 20, 8, 4]:
+      features[self._bin(game_loop, n_bins)] = 1.0
+      features = features[n_bins:]
+
+  def _bin(self, value, n_bins):
     bin_width = 24000 // n_bins
-    features = np.zeros(n_bins, dtype=np.float32)
     idx = int(value // bin_width)
-    idx = n_bins - 1 if idx >= n_bins else idx
-    features[idx] = 1.0
-    return features
+    return n_bins - 1 if idx >= n_bins else idx
 
   @property
   def num_dims(self):
     return 60 + 20 + 8 + 4
 
 
-class ActionSeqFeature(object):
+class ActionSeqFeature(FeatureBlock):
 
   def __init__(self, n_dims_action_space, seq_len):
     self._action_seq = [-1] * seq_len
@@ -206,23 +220,35 @@ class ActionSeqFeature(object):
     self._action_seq.pop(0)
     self._action_seq.append(action)
 
-  def features(self):
-    features = np.zeros(self._n_dims_action_space * len(self._action_seq),
-                        dtype=np.float32)
+  def features_into(self, out, offset):
+    features = out[offset:offset + self.num_dims]
+    features.fill(0)
     for i, action in enumerate(self._action_seq):
       assert action < self._n_dims_action_space
       if action >= 0:
         features[i * self._n_dims_action_space + action] = 1.0
-    return features
 
   @property
   def num_dims(self):
     return self._n_dims_action_space * len(self._action_seq)
 
 
-class WorkerFeature(object):
+class ActionMaskFeature(FeatureBlock):
+
+  def __init__(self, n_actions):
+    self._n_actions = n_actions
+
+  def features_into(self, out, offset, observation):
+    out[offset:offset + self._n_actions] = observation['action_mask']
+
+  @property
+  def num_dims(self):
+    return self._n_actions
+
+
+class WorkerFeature(FeatureBlock):
 
-  def features(self, dc):
+  def features_into(self, out, offset, dc):
     extractor_tags = set(u.tag for u in dc.units_of_type(
         UNIT_TYPE.ZERG_EXTRACTOR.value))
     workers = dc.units_of_type(UNIT_TYPE.ZERG_DRONE.value)
@@ -235,10 +261,11 @@ class WorkerFeature(object):
                    if u.orders[0].target_tag in extractor_tags]
     mineral_workers = [u for u in harvest_workers
                        if u.orders[0].target_tag not in extractor_tags]
-    return np.array([len(gas_workers),
-                     len(mineral_workers),
-                     len(workers) - len(gas_workers) - len(mineral_workers)],
-                    dtype=np.float32) / 20.0
+    features = out[offset:offset + 3]
+    features[:] = (len(gas_workers),
+                   len(mineral_workers),
+                   len(workers) - len(gas_workers) - len(mineral_workers))
+    features /= 20.0
 
   @property
   def num_dims(self):
@@ -6,76 +6,83 @@ import numpy as np
 
 from sc2learner.envs.common.const import ALLY_TYPE
 from sc2learner.envs.common.const import MAP
+from sc2learner.envs.common.unit_table import IdLookup
 
 
-class UnitTypeCountMapFeature(object):
+def _grid_cells(pos_x, pos_y, resolution, need_flip):
+  grid_width = (MAP.WIDTH - MAP.LEFT - MAP.RIGHT) / resolution
+  grid_height = (MAP.HEIGHT - MAP.TOP - MAP.BOTTOM) / resolution
+  x = np.floor_divide(pos_x - MAP.LEFT, grid_width)
+  y = resolution - 1 - np.floor_divide(pos_y - MAP.BOTTOM, grid_height)
+  x, y = x.astype(np.int64), y.astype(np.int64)
+  # negative cells wrap around, as plain numpy indexing would do
+  x[x < 0] += resolution
+  y[y < 0] += resolution
+  cells = np.ravel_multi_index((y, x), (resolution, resolution))
+  # flipping both axes is a reversal of the flattened cell index
+  if need_flip: cells = resolution * resolution - 1 - cells
+  return cells
+
+
+def _count_maps_into(out, offset, channels, cells, num_channels):
+  num_cells = out.shape[1] * out.shape[2]
+  features = out[offset:offset + num_channels].reshape(-1)
+  features[:] = np.bincount(channels * num_cells + cells,
+                            minlength=num_channels * num_cells)
+  features /= 5.0
+
+
+class CountMapFeatureBlock(object):
+
+  def features(self, *args, **kwargs):
+    out = np.empty((self.num_channels, self._resolution, self._resolution),
+                   dtype=np.float32)
+    self.features_into(out, 0, *args, **kwargs)
+    return out
+
+
+class UnitTypeCountMapFeature(CountMapFeatureBlock):
 
   def __init__(self, type_map, resolution):
     self._type_map = type_map
     self._resolution = resolution
+    self._channel_of = IdLookup(type_map)
+    self._alliance_of = IdLookup({ALLY_TYPE.SELF.value: 0,
+                                  ALLY_TYPE.ENEMY.value: 1})
 
-  def features(self, observation, need_flip=False):
-    self_units = [u for u in observation['units']
-                  if u.int_attr.alliance == ALLY_TYPE.SELF.value]
-    enemy_units = [u for u in observation['units']
-                   if u.int_attr.alliance == ALLY_TYPE.ENEMY.value]
-    self_features = self._generate_features(self_units)
-    enemy_features = self._generate_features(enemy_units)
-    features = np.concatenate((self_features, enemy_features))
-    if need_flip: features = np.flip(np.flip(features, axis=1), axis=2).copy()
-    return features
+  def features_into(self, out, offset, dc, need_flip=False):
+    unit_table = dc.unit_table
+    num_channels = max(self._type_map.values()) + 1
+    alliances = self._alliance_of(unit_table.alliance)
+    channels = self._channel_of(unit_table.unit_type)
+    valid = (alliances >= 0) & (channels >= 0)
+    cells = _grid_cells(unit_table.pos_x[valid], unit_table.pos_y[valid],
+                        self._resolution, need_flip)
+    _count_maps_into(out, offset,
+                     alliances[valid] * num_channels + channels[valid], cells,
+                     self.num_channels)
 
   @property
   def num_channels(self):
     return (max(self._type_map.values()) + 1) * 2
 
-  def _generate_features(self, units):
-    num_channels = max(self._type_map.values()) + 1
-    features = np.zeros((num_channels, self._resolution, self._resolution),
-                        dtype=np.float32)
-    grid_width = (MAP.WIDTH - MAP.LEFT - MAP.RIGHT) / self._resolution
-    grid_height = (MAP.HEIGHT - MAP.TOP - MAP.BOTTOM) / self._resolution
-    for u in units:
-      if u.unit_type in self._type_map:
-        c = self._type_map[u.unit_type]
-        x = (u.float_attr.pos_x - MAP.LEFT) // grid_width
-        y = self._resolution - 1 - \
-            (u.float_attr.pos_y - MAP.BOTTOM) // grid_height
-        features[c, int(y), int(x)] += 1.0
-    return features / 5.0
-
-
-class AllianceCountMapFeature(object):
+
+class AllianceCountMapFeature(CountMapFeatureBlock):
 
   def __init__(self, resolution):
     self._resolution = resolution
+    self._alliance_of = IdLookup({ALLY_TYPE.SELF.value: 0,
+                                  ALLY_TYPE.ENEMY.value: 1,
+                                  ALLY_TYPE.NEUTRAL.value: 2})
 
-  def features(self, observation, need_flip=False):
-    self_units = [u for u in observation['units']
-                  if u.int_attr.alliance == ALLY_TYPE.SELF.value]
-    enemy_units = [u for u in observation['units']
-                   if u.int_attr.alliance == ALLY_TYPE.ENEMY.value]
-    neutral_units = [u for u in observation['units']
-                     if u.int_attr.alliance == ALLY_TYPE.NEUTRAL.value]
-    self_features = self._generate_features(self_units)
-    enemy_features = self._generate_features(enemy_units)
-    neutral_features = self._generate_features(neutral_units)
-    features = np.concatenate((self_features, enemy_features, neutral_features))
-    if need_flip: features = np.flip(np.flip(features, axis=1), axis=2).copy()
-    return features
+  def features_into(self, out, offset, dc, need_flip=False):
+    unit_table = dc.unit_table
+    channels = self._alliance_of(unit_table.alliance)
+    valid = channels >= 0
+    cells = _grid_cells(unit_table.pos_x[valid], unit_table.pos_y[valid],
+                        self._resolution, need_flip)
+    _count_maps_into(out, offset, channels[valid], cells, self.num_channels)
 
   @property
   def num_channels(self):
     return 3
-
-  def _generate_features(self, units):
-    features = np.zeros((1, self._resolution, self._resolution),
-                        dtype=np.float32)
-    grid_width = (MAP.WIDTH - MAP.LEFT - MAP.RIGHT) / self._resolution
-    grid_height = (MAP.HEIGHT - MAP.TOP - MAP.BOTTOM) / self._resolution
-    for u in units:
-      x = (u.float_attr.pos_x - MAP.LEFT) // grid_width
-      y = self._resolution - 1 - \
-          (u.float_attr.pos_y - MAP.BOTTOM) // grid_height
-      features[0, int(y), int(x)] += 1.0
-    return features / 5.0
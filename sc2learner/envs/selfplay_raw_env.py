@@ -5,6 +5,8 @@ from __future__ import print_function
 import gym
 from pysc2.env import sc2_env
 
+from sc2learner.envs.raw_env import agent_interface_format
+from sc2learner.envs.game_manager import GameInstanceManager
 from sc2learner.envs.spaces.pysc2_raw import PySC2RawAction
 from sc2learner.envs.spaces.pysc2_raw import PySC2RawObservation
 from sc2learner.utils.utils import tprint
@@ -36,7 +38,9 @@ class SC2SelfplayRawEnv(gym.Env):
                game_steps_per_episode=None,
                tie_to_lose=False,
                score_index=None,
-               random_seed=None):
+               random_seed=None,
+               raw_only=False,
+               prepare_game_loops=0):
     self._map_name = map_name
     self._step_mul = step_mul
     self._resolution = resolution
@@ -47,10 +51,11 @@ class SC2SelfplayRawEnv(gym.Env):
     self._tie_to_lose = tie_to_lose
     self._score_index = score_index
     self._random_seed = random_seed
+    self._raw_only = raw_only
+    self._prepare_game_loops = prepare_game_loops
     self._reseted = False
-    self._first_create = True
 
-    self._sc2_env = self._safe_create_env()
+    self._games = GameInstanceManager(self._create_env, self._next_seed)
     self.observation_space = PySC2RawObservation(self._sc2_env.observation_spec)
     self.action_space = PySC2RawAction()
 
@@ -66,49 +71,54 @@ class SC2SelfplayRawEnv(gym.Env):
       if self._tie_to_lose and reward == 0:
         reward = -1.0
       tprint("Episode Done. Outcome %f" % reward)
+    else:
+      self._prepare_next_game(observation[0])
     info = {}
     return (observation, reward, done, info)
 
   def reset(self):
-    timesteps = self._safe_reset()
+    timesteps = self._games.reset()
     self._reseted = True
     return [timesteps[0].observation, timesteps[1].observation]
 
-  def _reset(self):
-    if not self._first_create:
-      self._sc2_env.close()
-      self._sc2_env = self._create_env()
-      self._first_create = False
-    return self._sc2_env.reset()
+  def close(self):
+    self._games.close()
 
-  def _safe_reset(self, max_retry=10):
-    for _ in range(max_retry - 1):
-      try: return self._reset()
-      except: pass
-    return self._reset()
+  @property
+  def map_name(self):
+    return self._map_name
 
-  def close(self):
-    self._sc2_env.close()
+  @property
+  def game_timings(self):
+    return self._games.timings
+
+  def _prepare_next_game(self, observation):
+    # launches the next game ahead of the episode limit
+    if self._prepare_game_loops > 0 and self._game_steps_per_episode:
+      game_loops_left = (self._game_steps_per_episode -
+                         observation["game_loop"][0])
+      if game_loops_left <= self._prepare_game_loops:
+        self._games.prepare_next()
 
-  def _create_env(self):
+  @property
+  def _sc2_env(self):
+    return self._games.game
+
+  def _next_seed(self):
     self._random_seed = (self._random_seed + 1) & 0xFFFFFFFF
+    return self._random_seed
+
+  def _create_env(self, random_seed):
     players=[sc2_env.Agent(sc2_env.Race[self._agent_race]),
              sc2_env.Agent(sc2_env.Race[self._opponent_race])]
-    agent_interface_format=sc2_env.parse_agent_interface_format(
-        feature_screen=self._resolution, feature_minimap=self._resolution)
     return sc2_env.SC2Env(
         map_name=self._map_name,
         step_mul=self._step_mul,
         players=players,
-        agent_interface_format=agent_interface_format,
+        agent_interface_format=agent_interface_format(self._resolution,
+                                                      self._raw_only),
         disable_fog=self._disable_fog,
         game_steps_per_episode=self._game_steps_per_episode,
         visualize=False,
         score_index=self._score_index,
-        random_seed=self._random_seed)
-
-  def _safe_create_env(self, max_retry=10):
-    for _ in range(max_retry - 1):
-      try: return self._create_env()
-      except: pass
-    return self._create_env()
+        random_seed=random_seed)